@@ -0,0 +1,126 @@
+"""catalog performance schema
+
+Columns, tables and indexes added by the catalog, order and stock work:
+orders.idempotency_key, products.image_status, the stock ledger columns,
+catalog_version, product_listing and the indexes of the hot queries.
+Indexes that `flask ensure-indexes` already built (CONCURRENTLY, on a
+large PostgreSQL database) are skipped. The full-text search indexes are
+in 0004_search_indexes.
+
+Revision ID: 0002_catalog_performance
+Revises: 0001_baseline
+Create Date: 2026-10-18 04:47:24.646648
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_catalog_performance'
+down_revision = '0001_baseline'
+branch_labels = None
+depends_on = None
+
+
+# (name, table, columns, unique), the same as on the models
+INDEXES = [
+    ('ix_categories_name', 'categories', ['name'], False),
+    ('ix_subcategories_name', 'subcategories', ['name'], False),
+    ('ix_orders_user_id_id', 'orders', ['user_id', 'id'], False),
+    ('ix_order_detail_order_id_id', 'order_detail', ['order_id', 'id'], False),
+    ('ix_order_detail_product_id', 'order_detail', ['product_id'], False),
+    ('ix_products_category_id_id', 'products', ['category_id', 'id'], False),
+    ('ix_products_category_id_subcategory_id_id', 'products', ['category_id', 'subcategory_id', 'id'], False),
+    ('ix_products_subcategory_id', 'products', ['subcategory_id'], False),
+    ('ix_product_listing_category_id_id', 'product_listing', ['category_id', 'id'], False),
+    ('ix_product_listing_category_id_subcategory_id_id', 'product_listing',
+     ['category_id', 'subcategory_id', 'id'], False),
+    ('ix_product_listing_subcategory_id', 'product_listing', ['subcategory_id'], False),
+    ('ix_otp_email', 'otp', ['email'], True),
+    ('ix_otp_expires_at', 'otp', ['expires_at'], False),
+    ('ix_stock_products_id_id', 'stock', ['products_id', 'id'], False),
+    ('ix_stock_order_id', 'stock', ['order_id'], False),
+]
+
+
+def upgrade():
+    op.create_table('catalog_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('product_listing',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.Column('photo', sa.String(length=200), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.Column('subcategory_id', sa.Integer(), nullable=False),
+    sa.Column('price', sa.Float(), nullable=False),
+    sa.Column('category', sa.String(length=120), nullable=False),
+    sa.Column('subcategory', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('idempotency_key', sa.String(length=120), nullable=True))
+        batch_op.create_unique_constraint('uq_orders_user_idempotency_key', ['user_id', 'idempotency_key'])
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('image_status', sa.String(length=20), server_default='ready', nullable=False))
+
+    with op.batch_alter_table('stock', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reason', sa.String(length=20), server_default='restock', nullable=False))
+        batch_op.add_column(sa.Column('order_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_stock_order_id_orders', 'orders', ['order_id'], ['id'])
+
+    if op.get_bind().dialect.name != 'sqlite':
+        # order details are keyed by their own id (the baseline also had order_id in the key)
+        op.drop_constraint('order_detail_pkey', 'order_detail', type_='primary')
+        op.create_primary_key('order_detail_pkey', 'order_detail', ['id'])
+
+    # one code per email before the unique index
+    op.execute("DELETE FROM otp WHERE id NOT IN (SELECT max(id) FROM otp GROUP BY email)")
+
+    for name, table, columns, unique in INDEXES:
+        op.create_index(name, table, columns, unique=unique, if_not_exists=True)
+
+    # fill the read model and open the stock ledger of the existing products
+    op.execute(
+        "INSERT INTO product_listing "
+        "(id, name, photo, amount, category_id, subcategory_id, price, category, subcategory) "
+        "SELECT p.id, p.name, p.photo, p.amount, p.category_id, p.subcategory_id, p.price, c.name, s.name "
+        "FROM products p "
+        "JOIN categories c ON c.id = p.category_id "
+        "JOIN subcategories s ON s.id = p.subcategory_id"
+    )
+    op.execute(
+        "INSERT INTO stock (products_id, quantity, date_in, reason) "
+        "SELECT p.id, CAST(p.amount AS INTEGER), CURRENT_TIMESTAMP, 'initial' FROM products p "
+        "WHERE p.amount <> 0 AND NOT EXISTS (SELECT 1 FROM stock s WHERE s.products_id = p.id)"
+    )
+
+
+def downgrade():
+    for name, table, _, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
+
+    if op.get_bind().dialect.name != 'sqlite':
+        op.drop_constraint('order_detail_pkey', 'order_detail', type_='primary')
+        op.create_primary_key('order_detail_pkey', 'order_detail', ['id', 'order_id'])
+
+    with op.batch_alter_table('stock', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_stock_order_id_orders', type_='foreignkey')
+        batch_op.drop_column('order_id')
+        batch_op.drop_column('reason')
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_column('image_status')
+
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_orders_user_idempotency_key', type_='unique')
+        batch_op.drop_column('idempotency_key')
+
+    op.drop_table('product_listing')
+    op.drop_table('catalog_version')
@@ -0,0 +1,37 @@
+"""stock ledger without a foreign key to products
+
+A deleted product keeps its ledger, closed with a "closing" row, so
+stock.products_id can no longer reference products.
+
+Revision ID: 0003_stock_ledger
+Revises: 0002_catalog_performance
+Create Date: 2026-10-18 09:12:40.118502
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_stock_ledger'
+down_revision = '0002_catalog_performance'
+branch_labels = None
+depends_on = None
+
+# the baseline created the foreign key without a name; SQLite batch mode finds it by this one
+NAMING_CONVENTION = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        with op.batch_alter_table('stock', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.drop_constraint('fk_stock_products_id_products', type_='foreignkey')
+    else:
+        op.drop_constraint('stock_products_id_fkey', 'stock', type_='foreignkey')
+
+
+def downgrade():
+    # rows of deleted products can not point to products again
+    op.execute("DELETE FROM stock WHERE products_id NOT IN (SELECT id FROM products)")
+    with op.batch_alter_table('stock', schema=None) as batch_op:
+        batch_op.create_foreign_key('stock_products_id_fkey', 'products', ['products_id'], ['id'])
@@ -0,0 +1,78 @@
+"""full-text search indexes
+
+On PostgreSQL the pg_trgm extension and the GIN indexes over
+product_listing.name; on SQLite the products_fts FTS5 table, filled from
+products and kept in sync by triggers (skipped when SQLite was built
+without FTS5, searches then use LIKE). See api/search.py.
+
+Revision ID: 0004_search_indexes
+Revises: 0003_stock_ledger
+Create Date: 2026-10-18 09:48:05.301774
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_search_indexes'
+down_revision = '0003_stock_ledger'
+branch_labels = None
+depends_on = None
+
+POSTGRES_UPGRADE = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_product_listing_name_tsv ON product_listing "
+    "USING gin (to_tsvector('simple', name))",
+    "CREATE INDEX IF NOT EXISTS ix_product_listing_name_trgm ON product_listing "
+    "USING gin (name gin_trgm_ops)",
+    # built by earlier `flask search-index` runs, searches moved to product_listing
+    "DROP INDEX IF EXISTS ix_products_name_tsv",
+    "DROP INDEX IF EXISTS ix_products_name_trgm",
+]
+
+POSTGRES_DOWNGRADE = [
+    "DROP INDEX IF EXISTS ix_product_listing_name_trgm",
+    "DROP INDEX IF EXISTS ix_product_listing_name_tsv",
+]
+
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts "
+    "USING fts5(name, tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN "
+    "INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name ON products BEGIN "
+    "UPDATE products_fts SET name = new.name WHERE rowid = old.id; END",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN "
+    "DELETE FROM products_fts WHERE rowid = old.id; END",
+    "DELETE FROM products_fts",
+    "INSERT INTO products_fts (rowid, name) SELECT id, name FROM products",
+]
+
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS products_fts_delete",
+    "DROP TRIGGER IF EXISTS products_fts_update",
+    "DROP TRIGGER IF EXISTS products_fts_insert",
+    "DROP TABLE IF EXISTS products_fts",
+]
+
+
+def statements(upgrade):
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        return POSTGRES_UPGRADE if upgrade else POSTGRES_DOWNGRADE
+    if bind.dialect.name == 'sqlite':
+        if upgrade and not bind.execute(sa.text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar():
+            return []
+        return SQLITE_UPGRADE if upgrade else SQLITE_DOWNGRADE
+    return []
+
+
+def upgrade():
+    for statement in statements(upgrade=True):
+        op.execute(statement)
+
+
+def downgrade():
+    for statement in statements(upgrade=False):
+        op.execute(statement)
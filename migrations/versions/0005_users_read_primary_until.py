@@ -0,0 +1,29 @@
+"""users.read_primary_until
+
+Keeps the read-your-writes window of the read replica for JWT clients
+that do not send cookies, see api/replica.py.
+
+Revision ID: 0005_read_primary_until
+Revises: 0004_search_indexes
+Create Date: 2026-10-18 10:31:52.604417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_read_primary_until'
+down_revision = '0004_search_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('read_primary_until', sa.Float(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('read_primary_until')
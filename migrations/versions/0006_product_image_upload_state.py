@@ -0,0 +1,34 @@
+"""product image upload state
+
+When the photo of a product was queued, how many tries it took and why
+it failed, so every worker reports the same status and uploads left
+pending by a dead worker can be found (see api/uploads.py).
+
+Revision ID: 0006_image_upload_state
+Revises: 0005_read_primary_until
+Create Date: 2026-10-18 11:06:27.550913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_image_upload_state'
+down_revision = '0005_read_primary_until'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('image_queued_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('image_attempts', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('image_error', sa.String(length=250), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_column('image_error')
+        batch_op.drop_column('image_attempts')
+        batch_op.drop_column('image_queued_at')
@@ -7,4 +7,9 @@ npm run build
 
 pipenv install
 
+# a database created before migrations/ existed has no alembic_version yet:
+# mark it as the baseline schema so the upgrade only applies what came after
+pipenv run stamp-baseline
+# builds the new indexes without locking the tables, the migration skips them
+pipenv run ensure-indexes
 pipenv run upgrade
@@ -1,17 +1,52 @@
-  
 import os
-from flask_admin import Admin
+import threading
+from flask import Flask
+from sqlalchemy.orm import scoped_session, sessionmaker
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
 from .models import db, User
-from flask_admin.contrib.sqla import ModelView
 
-def setup_admin(app):
-    app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
-    app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
-    admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
 
-    
+def build_admin(app):
+    # Flask-Admin is slow to import and only a few people ever open it, so it is
+    # loaded on the first request to /admin instead of on every worker boot
+    from flask_admin import Admin
+    from flask_admin.contrib.sqla import ModelView
+
+    admin_app = Flask(__name__)
+    admin_app.config.update(app.config)
+    # the admin has its own Flask app but uses the main app's engine and connection pool,
+    # with a session per request
+    with app.app_context():
+        session = scoped_session(sessionmaker(bind=db.engine))
+    admin_app.teardown_appcontext(lambda exception: session.remove())
+    admin = Admin(admin_app, name='4Geeks Admin', template_mode='bootstrap3', url='/')
+
+
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
+    admin.add_view(ModelView(User, session))
 
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(ModelView(YourModelName, session))
+    return admin_app
+
+
+class LazyAdmin:
+    """WSGI app mounted on /admin that builds the admin on its first request."""
+
+    def __init__(self, app):
+        self.app = app
+        self._wsgi_app = None
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if self._wsgi_app is None:
+            with self._lock:
+                if self._wsgi_app is None:
+                    self._wsgi_app = build_admin(self.app).wsgi_app
+        return self._wsgi_app(environ, start_response)
+
+
+def setup_admin(app):
+    app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
+    app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
+    app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {'/admin': LazyAdmin(app)})
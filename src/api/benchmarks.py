@@ -0,0 +1,668 @@
+"""
+In-process benchmarks, run through the Flask test client.
+
+They write rows to whatever DATABASE_URL points at, so run them against a
+scratch database, e.g.:
+    $ DATABASE_URL=sqlite:////tmp/bench.db flask bench-order-history
+
+`flask bench-endpoints` runs the whole API suite against the seeded
+fixture data, writes the results as JSON and fails when they regress
+past a saved baseline.
+"""
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from statistics import median
+import requests
+from flask import current_app
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event, func
+from api.models import db, User, Product, ProductListing, Category, Subcategory, Order, OrderDetail, Stock
+from api.cache import catalog_cache
+from api import catalog, fixtures, inventory, listing, passwords, serializers
+
+
+class QueryCounter:
+    """Counts the SQL statements sent to the app's engine inside a `with` block."""
+
+    def __init__(self, engine=None):
+        self.engine = engine or db.engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def time_request(client, method, path, repeat, **kwargs):
+    """Returns (latencies in ms, SQL statements per request, last response)."""
+    samples = []
+    with QueryCounter() as queries:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = client.open(path, method=method, **kwargs)
+            samples.append((time.perf_counter() - start) * 1000)
+    return samples, queries.count / repeat, response
+
+
+@contextmanager
+def scratch_customer(product_count, stock=1000):
+    """Creates a throwaway user and products with `stock` units each, and removes them with their orders afterwards."""
+    category = Category(name="bench-orders")
+    db.session.add(category)
+    db.session.flush()
+    subcategory = Subcategory(name="bench-orders", category_id=category.id)
+    db.session.add(subcategory)
+    db.session.flush()
+    products = [
+        Product(name=f"bench product {i}", public_id="bench", photo="bench", amount=stock, price=10,
+                category_id=category.id, subcategory_id=subcategory.id)
+        for i in range(product_count)
+    ]
+    user = User(name="bench", lastname="bench", email=f"bench-orders-{time.time_ns()}@example.com",
+                password="-", salt="-")
+    db.session.add_all(products + [user])
+    db.session.flush()
+    for product in products:
+        inventory.open_stock(product.id, stock)
+    product_ids = [product.id for product in products]
+    listing.sync_products(*product_ids)
+    db.session.commit()
+    try:
+        yield user, products
+    finally:
+        db.session.rollback()
+        order_ids = db.session.query(Order.id).filter(Order.user_id == user.id)
+        Stock.query.filter(Stock.products_id.in_(product_ids)).delete(synchronize_session=False)
+        OrderDetail.query.filter(OrderDetail.order_id.in_(order_ids)).delete(synchronize_session=False)
+        Order.query.filter(Order.user_id == user.id).delete(synchronize_session=False)
+        for row in products + [user, subcategory, category]:
+            db.session.delete(row)
+        listing.sync_products(*product_ids)
+        db.session.commit()
+
+
+def auth_headers(user):
+    return {"Authorization": f"Bearer {create_access_token(identity=str(user.id))}"}
+
+
+def bench_order_history(app, sizes, items_per_order=5, repeat=20, page_size=20):
+    client = app.test_client()
+    with scratch_customer(items_per_order) as (user, products):
+        headers = auth_headers(user)
+        print(f"{'orders':>8} {'page p50 ms':>12} {'page queries':>13} {'full p50 ms':>12} {'full queries':>13}")
+        created = 0
+        for size in sorted(sizes):
+            add_orders(user.id, products, size - created)
+            created = size
+            page, page_queries, _ = time_request(
+                client, "GET", f"/api/orders?limit={page_size}", repeat, headers=headers)
+            full, full_queries, _ = time_request(
+                client, "GET", "/api/orders", max(1, repeat // 4), headers=headers)
+            print(f"{size:>8} {median(page):>12.2f} {page_queries:>13.0f} "
+                  f"{median(full):>12.2f} {full_queries:>13.0f}")
+
+
+def _idempotent_retries(app, threads=8, items_per_order=5):
+    """
+    Fires the same Idempotency-Key from parallel threads. Returns the
+    responses as (status, order_id, seconds) with the orders and order
+    details that exist afterwards.
+    """
+    with scratch_customer(items_per_order) as (user, products):
+        headers = {**auth_headers(user), "Idempotency-Key": f"bench-{time.time_ns()}"}
+        body = {
+            "total": 10 * len(products),
+            "items": [{"product_id": product.id, "quantity": 1, "price": product.price,
+                       "name": product.name} for product in products],
+        }
+        barrier = threading.Barrier(threads)
+
+        def post(_):
+            client = app.test_client()
+            barrier.wait()
+            start = time.perf_counter()
+            response = client.post("/api/order", json=body, headers=headers)
+            return response.status_code, (response.get_json() or {}).get("order_id"), time.perf_counter() - start
+
+        with ThreadPoolExecutor(threads) as pool:
+            responses = list(pool.map(post, range(threads)))
+
+        db.session.rollback()
+        orders = [order_id for (order_id,) in db.session.query(Order.id).filter(Order.user_id == user.id)]
+        details = OrderDetail.query.filter(OrderDetail.order_id.in_(orders)).count()
+        return responses, orders, details
+
+
+def bench_order_idempotency(app, threads=8, items_per_order=5):
+    """Times parallel retries of one order; tests/test_orders.py checks that only one order is created."""
+    responses, orders, details = _idempotent_retries(app, threads, items_per_order)
+    took = [seconds * 1000 for _, _, seconds in responses]
+    print(f"{threads} parallel retries: p50 {percentile(took, 50):.1f} ms, max {max(took):.1f} ms")
+    print("statuses:", sorted(status for status, _, _ in responses))
+    print(f"orders created: {len(orders)}, details: {details}")
+
+
+def _stock_contention(app, threads=16, orders=400, products=5, stock=100, max_quantity=3):
+    """
+    Places `orders` orders from `threads` threads against a few products
+    with `stock` units each, far fewer than the orders ask for. Returns the
+    responses as (status, ms), the seconds it all took and, per product,
+    (units sold, amount left, ledger balance, listed amount).
+    """
+    with scratch_customer(products, stock=stock) as (user, rows):
+        headers = auth_headers(user)
+        product_ids = [product.id for product in rows]
+
+        def place(number):
+            rng = random.Random(number)
+            items = [{"product_id": product_id, "quantity": rng.randint(1, max_quantity), "price": 10,
+                      "name": "bench"} for product_id in rng.sample(product_ids, min(2, len(product_ids)))]
+            client = app.test_client()
+            start = time.perf_counter()
+            response = client.post("/api/order", json={"total": 20, "items": items}, headers=headers)
+            return response.status_code, (time.perf_counter() - start) * 1000
+
+        with ThreadPoolExecutor(threads) as pool:
+            start = time.perf_counter()
+            results = list(pool.map(place, range(orders)))
+            elapsed = time.perf_counter() - start
+
+        db.session.rollback()
+        order_ids = db.session.query(Order.id).filter(Order.user_id == user.id)
+        sold = dict(
+            db.session.query(OrderDetail.product_id, func.sum(OrderDetail.quantity))
+            .filter(OrderDetail.order_id.in_(order_ids))
+            .group_by(OrderDetail.product_id)
+        )
+        amounts = dict(db.session.query(Product.id, Product.amount).filter(Product.id.in_(product_ids)))
+        ledger = dict(
+            db.session.query(Stock.products_id, func.sum(Stock.quantity))
+            .filter(Stock.products_id.in_(product_ids))
+            .group_by(Stock.products_id)
+        )
+        listed = dict(db.session.query(ProductListing.id, ProductListing.amount)
+                      .filter(ProductListing.id.in_(product_ids)))
+        return results, elapsed, {
+            product_id: (sold.get(product_id, 0), amounts[product_id], ledger.get(product_id, 0),
+                         listed.get(product_id))
+            for product_id in product_ids
+        }
+
+
+def bench_stock_contention(app, threads=16, orders=400, products=5, stock=100, max_quantity=3):
+    """Times concurrent checkouts of scarce products; tests/test_inventory.py checks nothing is oversold."""
+    results, elapsed, per_product = _stock_contention(app, threads, orders, products, stock, max_quantity)
+    placed = [took for status, took in results if status == 200]
+    refused = [took for status, took in results if status == 409]
+    others = sorted({status for status, _ in results if status not in (200, 409)})
+    print(f"{threads} threads, {orders} orders, {products} products with {stock} units each")
+    print(f"placed: {len(placed)}, out of stock (409): {len(refused)}, other responses: {others or 'none'}")
+    print(f"{orders / elapsed:.1f} orders/s, p50 {percentile([t for _, t in results], 50):.1f} ms, "
+          f"p95 {percentile([t for _, t in results], 95):.1f} ms")
+    print(f"{'product':>8} {'sold':>6} {'left':>6} {'ledger':>7} {'listed':>7}")
+    for product_id, (units, amount, balance, listed) in per_product.items():
+        print(f"{product_id:>8} {units:>6} {amount:>6.0f} {balance:>7} {listed:>7.0f}")
+
+
+def add_orders(user_id, products, count):
+    now = datetime.now()
+    for _ in range(count):
+        order = Order(user_id=user_id, date=now, price=10 * len(products), address="bench",
+                      deliver_address="bench", status="OK")
+        db.session.add(order)
+        db.session.flush()
+        db.session.execute(OrderDetail.__table__.insert(), [
+            {"order_id": order.id, "product_id": product.id, "name": product.name,
+             "quantity": 1, "price": product.price}
+            for product in products
+        ])
+    db.session.commit()
+
+
+@contextmanager
+def scratch_products(count, batch_size=10000):
+    """Bulk inserts `count` products in a throwaway category and removes them afterwards."""
+    category = Category(name="bench-products")
+    db.session.add(category)
+    db.session.flush()
+    subcategory = Subcategory(name="bench-products", category_id=category.id)
+    db.session.add(subcategory)
+    db.session.commit()
+    try:
+        for start in range(0, count, batch_size):
+            db.session.execute(Product.__table__.insert(), [
+                {"name": f"bench product {i}", "public_id": "bench", "photo": "bench", "amount": 0,
+                 "price": 10, "category_id": category.id, "subcategory_id": subcategory.id}
+                for i in range(start, min(count, start + batch_size))
+            ])
+        listing.sync_category(category.id)
+        db.session.commit()
+        yield category, subcategory
+    finally:
+        db.session.rollback()
+        Product.query.filter_by(category_id=category.id).delete(synchronize_session=False)
+        listing.sync_category(category.id)
+        db.session.delete(subcategory)
+        db.session.delete(category)
+        db.session.commit()
+
+
+def peak_memory(client, path):
+    """Peak traced memory (MB) and seconds to fetch `path` and drain its body."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = client.get(path, buffered=False)
+    if response.status_code != 200:
+        raise RuntimeError(f"GET {path} returned {response.status_code}")
+    for _ in response.response:
+        pass
+    response.close()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2**20, elapsed
+
+
+def bench_stream_memory(app, sizes, buffered_max=100000):
+    client = app.test_client()
+    print(f"{'rows':>9} {'stream MB':>10} {'stream s':>9} {'buffered MB':>12} {'buffered s':>11}")
+    for size in sorted(sizes):
+        with scratch_products(size) as (category, _):
+            path = f"/api/products/categories/{category.id}"
+            stream_mb, stream_s = peak_memory(client, path + "?stream=1")
+            buffered = "-"
+            if size <= buffered_max:
+                catalog_cache.clear()
+                buffered_mb, buffered_s = peak_memory(client, path)
+                catalog_cache.clear()
+                buffered = f"{buffered_mb:>12.1f} {buffered_s:>11.2f}"
+            print(f"{size:>9} {stream_mb:>10.1f} {stream_s:>9.2f} {buffered:>12}")
+
+
+def bench_serializers(rows, repeat=5):
+    """Times encoding one category listing with the ORM serialize() path and the serializers module."""
+    with scratch_products(rows) as (category, subcategory):
+        category_id = category.id
+        dumps = current_app.json.dumps
+
+        def orm_serialize():
+            db.session.expunge_all()
+            return dumps([product.serialize() for product in Product.query.filter_by(category_id=category_id)])
+
+        def row_dicts():
+            query = catalog.filtered_products(category_id=category_id)
+            return dumps([serializers.product_to_dict(row) for row in query])
+
+        def fragments_cold():
+            serializers.product_fragments = serializers.ProductFragments(serializers.FRAGMENT_CACHE_SIZE)
+            return serializers.encode_products(catalog.filtered_products(category_id=category_id))
+
+        def fragments_warm():
+            return serializers.encode_products(catalog.filtered_products(category_id=category_id))
+
+        variants = [
+            ("ORM serialize() + json", orm_serialize),
+            ("column rows + json", row_dicts),
+            ("fragments, cold", fragments_cold),
+            ("fragments, warm", fragments_warm),
+        ]
+        print(f"encoder: {'orjson' if serializers.orjson else 'json'}, rows: {rows}")
+        baseline = None
+        for name, run in variants:
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run()
+                samples.append((time.perf_counter() - start) * 1000)
+            took = median(samples)
+            baseline = baseline or took
+            print(f"{name:<24} {took:>9.1f} ms {baseline / took:>6.1f}x")
+        db.session.add_all([category, subcategory])
+
+
+# endpoint suite: every endpoint is measured against the same seeded data
+# (see api.fixtures) and compared with a saved JSON baseline
+
+NOISE_FLOOR_MS = 1.0
+
+
+def fixture_context(orders, seed):
+    """Seeds the fixture data unless it is already there; returns what the scenarios need."""
+    if User.query.filter_by(lastname="Fixture").first() is None:
+        fixtures.generate(orders, seed=seed, report=lambda message: print(f"  seeding: {message}"))
+    buyer_id, _ = (
+        db.session.query(Order.user_id, func.count(Order.id))
+        .join(User, User.id == Order.user_id)
+        .filter(User.lastname == "Fixture")
+        .group_by(Order.user_id)
+        .order_by(func.count(Order.id).desc())
+        .first()
+    )
+    buyer = db.session.get(User, buyer_id)
+    top_up_fixture_stock()
+    products = (
+        db.session.query(Product.id, Product.name, Product.price, Product.category_id)
+        .filter(Product.public_id.like("fixture/%"))
+        .order_by(Product.id)
+        .limit(50)
+        .all()
+    )
+    return {"buyer": buyer, "headers": auth_headers(buyer), "products": products}
+
+
+def top_up_fixture_stock(units=10000):
+    """Restocks the fixture products the scenarios order from, so repeated runs never hit a 409."""
+    products = (
+        db.session.query(Product.id, Product.amount)
+        .filter(Product.public_id.like("fixture/%"))
+        .order_by(Product.id)
+        .limit(50)
+        .all()
+    )
+    for product_id, amount in products:
+        if amount < units:
+            inventory.restock(product_id, units - amount)
+    db.session.commit()
+
+
+def endpoint_scenarios(context, seed):
+    rng = random.Random(seed)
+    products = context["products"]
+    headers = context["headers"]
+
+    def order_body():
+        items = rng.sample(products, 3)
+        return {
+            "total": sum(item.price for item in items),
+            "items": [{"product_id": item.id, "name": item.name, "quantity": 1, "price": item.price}
+                      for item in items],
+        }
+
+    def related_path():
+        product = rng.choice(products)
+        return f"/api/products/related/{product.category_id}?product_id={product.id}"
+
+    # name -> (method, path or callable returning one, request kwargs or callable returning them)
+    return {
+        "products_listing": ("GET", "/api/products?limit=50", {}),
+        "category_listing": ("GET", f"/api/products/categories/{products[0].category_id}?limit=50", {}),
+        "search": ("GET", "/api/products/search?q=remeras&limit=20", {}),
+        "related": ("GET", related_path, {}),
+        "login": ("POST", "/api/login", {
+            "json": {"email": context["buyer"].email, "password": fixtures.PASSWORD}}),
+        "order_create": ("POST", "/api/order", lambda: {"json": order_body(), "headers": headers}),
+        "order_history": ("GET", "/api/orders?limit=20", {"headers": headers}),
+    }
+
+
+def measure_endpoint(client, method, path, kwargs, repeat, warmup=3):
+    samples, queries = [], []
+    for i in range(warmup + repeat):
+        url = path() if callable(path) else path
+        options = kwargs() if callable(kwargs) else kwargs
+        # measure the handler, not the catalog response cache
+        catalog_cache.clear()
+        with QueryCounter() as counter:
+            start = time.perf_counter()
+            response = client.open(url, method=method, **options)
+            took = time.perf_counter() - start
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        if i >= warmup:
+            samples.append(took * 1000)
+            queries.append(counter.count)
+    return {
+        "requests": repeat,
+        "p50_ms": round(percentile(samples, 50), 3),
+        "p95_ms": round(percentile(samples, 95), 3),
+        "p99_ms": round(percentile(samples, 99), 3),
+        "throughput_rps": round(repeat / (sum(samples) / 1000), 1),
+        "queries_per_request": max(queries),
+    }
+
+
+def regressions(results, baseline, threshold):
+    """Compares two runs; more SQL per request, or a p95 slower than the threshold allows, is a regression."""
+    found = []
+    for name, result in results["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if before is None:
+            continue
+        if result["queries_per_request"] > before["queries_per_request"]:
+            found.append(f"{name}: {before['queries_per_request']} -> {result['queries_per_request']} queries per request")
+        limit = before["p95_ms"] * (1 + threshold)
+        if result["p95_ms"] > limit and result["p95_ms"] - before["p95_ms"] > NOISE_FLOOR_MS:
+            found.append(f"{name}: p95 {before['p95_ms']:.2f} -> {result['p95_ms']:.2f} ms (limit {limit:.2f})")
+    return found
+
+
+def bench_endpoints(app, orders=10000, seed=42, repeat=50, only=None):
+    client = app.test_client()
+    context = fixture_context(orders, seed)
+    scenarios = endpoint_scenarios(context, seed)
+    results = {
+        "meta": {
+            "database": db.engine.dialect.name,
+            "orders": db.session.query(func.count(Order.id)).scalar(),
+            "seed": seed,
+            "repeat": repeat,
+            "python": platform.python_version(),
+            "created": datetime.now().isoformat(timespec="seconds"),
+        },
+        "endpoints": {},
+    }
+    print(f"{'endpoint':<18} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'queries':>8}")
+    for name, (method, path, kwargs) in scenarios.items():
+        if only and name not in only:
+            continue
+        result = measure_endpoint(client, method, path, kwargs, repeat)
+        results["endpoints"][name] = result
+        print(f"{name:<18} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+              f"{result['throughput_rps']:>8.1f} {result['queries_per_request']:>8}")
+    return results
+
+
+def bench_login(app, concurrency=8, logins=64, workers=(0, 2), queue_size=None):
+    """
+    Logs the fixture users in from `concurrency` threads with hashing inline and in
+    process pools of the given sizes, while one more thread keeps reading the catalog.
+    """
+    fixture_context(1000, 42)
+    users = [email for (email,) in db.session.query(User.email).filter(User.lastname == "Fixture").limit(logins)]
+    original = passwords.password_hasher
+    print(f"method: {passwords.METHOD}, {concurrency} concurrent clients, {len(users)} logins")
+    print(f"{'hash workers':<13} {'logins/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'429s':>5} {'catalog p95 ms':>15}")
+    try:
+        for size in workers:
+            hasher = passwords.PasswordHasher(passwords.METHOD, size, queue_size or max(size, 1) * 4)
+            passwords.password_hasher = hasher
+            # start the pool before timing
+            hasher.check("-", "-", "")
+            done = threading.Event()
+
+            def login(email):
+                client = app.test_client()
+                start = time.perf_counter()
+                response = client.post("/api/login", json={"email": email, "password": fixtures.PASSWORD})
+                return response.status_code, (time.perf_counter() - start) * 1000
+
+            def read_catalog():
+                client = app.test_client()
+                samples = []
+                while not done.is_set():
+                    catalog_cache.clear()
+                    start = time.perf_counter()
+                    client.get("/api/products?limit=20")
+                    samples.append((time.perf_counter() - start) * 1000)
+                return samples
+
+            with ThreadPoolExecutor(concurrency + 1) as pool:
+                reader = pool.submit(read_catalog)
+                start = time.perf_counter()
+                results = list(pool.map(login, users))
+                elapsed = time.perf_counter() - start
+                done.set()
+                catalog_samples = reader.result()
+            hasher.shutdown()
+
+            ok = [took for status, took in results if status == 200]
+            refused = sum(1 for status, _ in results if status == 429)
+            if len(ok) + refused != len(results):
+                raise RuntimeError(f"unexpected login responses: {sorted({status for status, _ in results})}")
+            print(f"{size or 'inline':<13} {len(ok) / elapsed:>9.1f} {percentile(ok, 50) if ok else 0:>8.1f} "
+                  f"{percentile(ok, 95) if ok else 0:>8.1f} {refused:>5} {percentile(catalog_samples, 95):>15.2f}")
+    finally:
+        passwords.password_hasher = original
+
+
+def start_server(root, env, port, timeout=30):
+    process = subprocess.Popen(
+        ["gunicorn", "-c", os.path.join(root, "gunicorn_config.py"), "wsgi", "--chdir", root],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            lines = process.stderr.read().decode(errors="replace").splitlines()
+            errors = [line for line in lines if "Error" in line] or lines or ["exited"]
+            raise RuntimeError(errors[-1].strip())
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/test-db", timeout=1).ok:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("did not answer in time")
+
+
+def bench_server(app, modes, clients=16, duration=10, port=8200, login_share=0.1):
+    """
+    Starts gunicorn with each worker class in turn (same gunicorn_config.py as in production)
+    and hits it from `clients` threads with catalog reads mixed with logins.
+    """
+    fixture_context(1000, 42)
+    category_id = db.session.query(Product.category_id).filter(Product.public_id.like("fixture/%")).limit(1).scalar()
+    emails = [email for (email,) in db.session.query(User.email).filter(User.lastname == "Fixture").limit(100)]
+    reads = ["/api/products?limit=20", f"/api/products/categories/{category_id}?limit=20",
+             "/api/products/search?q=remeras&limit=20"]
+    base = f"http://127.0.0.1:{port}"
+
+    print(f"{clients} clients for {duration}s each, {login_share:.0%} logins")
+    print(f"{'mode':<9} {'req/s':>7} {'read p50':>9} {'read p95':>9} {'login p50':>10} {'login p95':>10} {'errors':>7}")
+    for mode in modes:
+        env = {**os.environ, "WEB_WORKER_CLASS": mode, "PORT": str(port)}
+        try:
+            server = start_server(current_app.root_path, env, port)
+        except RuntimeError as e:
+            print(f"{mode:<9} failed to start: {e}")
+            continue
+        deadline = time.monotonic() + duration
+
+        def client(number):
+            rng = random.Random(number)
+            session = requests.Session()
+            samples = {"read": [], "login": [], "errors": 0}
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    if rng.random() < login_share:
+                        kind = "login"
+                        response = session.post(f"{base}/api/login", timeout=30,
+                                                json={"email": rng.choice(emails), "password": fixtures.PASSWORD})
+                    else:
+                        kind = "read"
+                        response = session.get(base + rng.choice(reads), timeout=30)
+                    ok = response.status_code == 200
+                except requests.RequestException:
+                    ok = False
+                if ok:
+                    samples[kind].append((time.perf_counter() - start) * 1000)
+                else:
+                    samples["errors"] += 1
+            return samples
+
+        try:
+            with ThreadPoolExecutor(clients) as pool:
+                results = list(pool.map(client, range(clients)))
+        finally:
+            server.terminate()
+            server.wait()
+        read = [took for result in results for took in result["read"]]
+        login = [took for result in results for took in result["login"]]
+        errors = sum(result["errors"] for result in results)
+
+        def pct(samples, value):
+            return f"{percentile(samples, value):.1f}" if samples else "-"
+
+        print(f"{mode:<9} {(len(read) + len(login)) / duration:>7.1f} {pct(read, 50):>9} {pct(read, 95):>9} "
+              f"{pct(login, 50):>10} {pct(login, 95):>10} {errors:>7}")
+
+
+# modules that must not be imported when a worker boots, they load on first use
+LAZY_MODULES = ("flask_admin", "flask_swagger", "flask_migrate", "alembic", "cloudinary", "requests", "api.commands")
+
+
+def import_profile(root):
+    """
+    Imports wsgi (which builds the app) in a fresh interpreter with -X importtime.
+    Returns (total ms, [(cumulative ms, module)] sorted slowest first, lazy modules that got imported).
+    """
+    code = f"import sys, wsgi; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=root,
+                            capture_output=True, text=True, check=True)
+    # a module is reported after everything it imported, so wsgi's subtree is the run of
+    # nested lines right before it (interpreter start-up imports come earlier)
+    subtree, modules, total = [], [], None
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth > 0:
+            subtree.append((depth, int(cumulative) / 1000, name.strip()))
+        elif name.strip() == "wsgi":
+            total = int(cumulative) / 1000
+            modules = sorted(((took, module) for depth, took, module in subtree if depth <= 2), reverse=True)
+        else:
+            subtree = []
+    return total, modules, [name for name in result.stdout.strip().split(",") if name]
+
+
+def best_import_profile(root, runs=3):
+    """The fastest of `runs` import profiles, see import_profile()."""
+    return min((import_profile(root) for _ in range(runs)), key=lambda profile: profile[0])
+
+
+def print_import_time(root, budget_ms, runs=3, top=10):
+    """Prints the boot import profile; tests/test_boot.py checks the budget."""
+    total, modules, eager = best_import_profile(root, runs)
+    print(f"import wsgi (builds the app): {total:.0f} ms, best of {runs}, budget {budget_ms} ms")
+    for took, name in modules[:top]:
+        print(f"  {took:>8.1f} ms  {name}")
+    if eager:
+        print(f"imported at boot but meant to load lazily: {', '.join(eager)}")
@@ -0,0 +1,174 @@
+"""
+Response cache for the catalog read routes.
+
+Entries are keyed by (catalog version, stock window, request path, the
+CACHE_PARAMS present in the query string), so unknown parameters can not
+create new entries, and kept in an LRU per worker bounded by entry count
+and by total body size. A catalog write bumps the version in the
+database, so every worker stops using its old entries as soon as it sees
+the new version (within CATALOG_VERSION_TTL seconds), and drops them.
+
+Orders do not bump the version, that would drop every cache on every
+checkout and make all orders update one row. They only change the
+amounts in product_listing, and cached responses show them once the
+stock window, CATALOG_STOCK_TTL seconds of wall-clock time shared by
+every worker, moves on.
+
+The version and the window are the strong ETag of every cached route, so
+a request whose If-None-Match still matches gets a 304 before the view
+runs any ORM query.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, make_response, request
+from api import catalog
+
+CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", 512))
+# total size of the cached bodies, per worker
+CACHE_BYTES = int(os.getenv("CATALOG_CACHE_BYTES", 64 * 1024 * 1024))
+# the query parameters the cached routes read, everything else is left out of the key
+CACHE_PARAMS = ("limit", "after", "q", "product_id", "stream")
+# seconds browsers and CDNs may reuse a catalog response without revalidating
+MAX_AGE = int(os.getenv("CATALOG_MAX_AGE", 30))
+# seconds a cached response may show stock amounts from before the latest orders
+STOCK_TTL = int(os.getenv("CATALOG_STOCK_TTL", 30))
+
+
+class LRUCache:
+
+    def __init__(self, maxsize, maxbytes=None, sizeof=len):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._entries[key]
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        if self.maxbytes is not None and size > self.maxbytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._sizes.pop(key)
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._sizes[key] = size
+            self.bytes += size
+            while len(self._entries) > self.maxsize or (self.maxbytes is not None and self.bytes > self.maxbytes):
+                evicted, _ = self._entries.popitem(last=False)
+                self.bytes -= self._sizes.pop(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "bytes": self.bytes,
+            "maxbytes": self.maxbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class CatalogCache(LRUCache):
+
+    def __init__(self, maxsize, maxbytes):
+        # entries are (body, mimetype)
+        super().__init__(maxsize, maxbytes, sizeof=lambda entry: len(entry[0]))
+        self.version = None
+
+    def lookup(self, version, key):
+        """`version` is a (catalog version, stock window) generation, see cache_generation()."""
+        if self.version is None or version > self.version:
+            # the catalog changed since these entries were stored; an older version
+            # (read from a lagging replica) keeps its own keys and clears nothing
+            self.clear()
+            self.version = version
+        return self.get((version, key))
+
+
+catalog_cache = CatalogCache(CACHE_SIZE, CACHE_BYTES)
+
+
+def cache_key():
+    return (request.path,) + tuple((name, request.args[name]) for name in CACHE_PARAMS if name in request.args)
+
+
+def stock_window():
+    return int(time.time() // STOCK_TTL)
+
+
+def cache_generation():
+    return catalog.current_version(), stock_window()
+
+
+def catalog_etag(generation):
+    return "catalog-{}-{}".format(*generation)
+
+
+def add_cache_headers(response, etag):
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = MAX_AGE
+    return response
+
+
+def cached_catalog_response(when=None):
+    """
+    Caches the 200 responses of a catalog GET route and answers matching
+    If-None-Match requests with 304. `when` is an optional predicate on the
+    current request; responses are only cached if it returns True.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if when is not None and not when():
+                return view(*args, **kwargs)
+
+            version = cache_generation()
+            etag = catalog_etag(version)
+            if request.if_none_match.contains(etag):
+                return add_cache_headers(current_app.response_class(status=304), etag)
+
+            key = cache_key()
+            cached = catalog_cache.lookup(version, key)
+            if cached is not None:
+                body, mimetype = cached
+                response = current_app.response_class(body, status=200, mimetype=mimetype)
+                return add_cache_headers(response, etag)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            if not response.is_streamed:
+                catalog_cache.set((version, key), (response.get_data(), response.mimetype))
+            return add_cache_headers(response, etag)
+        return wrapper
+    return decorator
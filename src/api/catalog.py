@@ -0,0 +1,131 @@
+"""
+Shared query layer for the product catalog.
+
+Every product listing route goes through product_listing_query(), which
+reads the denormalized product_listing table (see api/listing.py): the
+category and subcategory names are already on each row, so a listing is a
+single-table SELECT with no joins and no per-row lazy loads.
+
+catalog_changed() bumps the shared catalog version after any catalog write;
+current_version() is what the caches key on.
+"""
+import os
+import threading
+import time
+from sqlalchemy.exc import IntegrityError
+from api.models import db, ProductListing, CatalogVersion
+from api import serializers
+from api.pagination import paginate, is_paginated
+from api.related import related_products
+from api.replica import reading_from
+from api.streaming import stream_json_array
+
+# how long a worker trusts the catalog version it last read before asking the database again
+VERSION_TTL = float(os.getenv("CATALOG_VERSION_TTL", 2))
+
+
+def product_listing_query():
+    return db.session.query(*(getattr(ProductListing, field) for field in serializers.PRODUCT_FIELDS))
+
+
+def filtered_products(**filters):
+    query = product_listing_query()
+    for column, value in filters.items():
+        query = query.filter(getattr(ProductListing, column) == value)
+    return query
+
+
+def products_page(**filters):
+    """Returns (encoded JSON body, product count) for the page asked for in the request."""
+    rows, next_cursor = paginate(filtered_products(**filters), ProductListing.id)
+    body = serializers.page_body(serializers.encode_products(rows), next_cursor, is_paginated())
+    return body, len(rows)
+
+
+def has_products(**filters):
+    return db.session.query(filtered_products(**filters).exists()).scalar()
+
+
+def stream_products(**filters):
+    """Streaming response with every matching product, for ?stream=1."""
+    query = filtered_products(**filters).order_by(ProductListing.id)
+    return stream_json_array(query, serializers.product_fragments.encode)
+
+
+class VersionClock:
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        # (version, read_at) per database: a lagging replica must not have its old rows
+        # cached under the primary's newer version
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def current(self):
+        source = reading_from()
+        version, read_at = self._versions.get(source, (None, 0.0))
+        if version is None or time.monotonic() - read_at > self.ttl:
+            version = db.session.query(CatalogVersion.version).filter_by(id=1).scalar() or 0
+            self.remember(version, source)
+        return version
+
+    def bump(self):
+        try:
+            if not self._increment():
+                db.session.add(CatalogVersion(id=1, version=1))
+            db.session.commit()
+        except IntegrityError:
+            # another worker created the row first
+            db.session.rollback()
+            self._increment()
+            db.session.commit()
+        self.remember(db.session.query(CatalogVersion.version).filter_by(id=1).scalar())
+
+    def _increment(self):
+        return CatalogVersion.query.filter_by(id=1).update(
+            {CatalogVersion.version: CatalogVersion.version + 1}, synchronize_session=False)
+
+    def remember(self, version, source="primary"):
+        with self._lock:
+            self._versions[source] = (version, time.monotonic())
+
+
+version_clock = VersionClock(VERSION_TTL)
+
+
+def current_version():
+    return version_clock.current()
+
+
+def catalog_changed():
+    """Called by every catalog write route after committing."""
+    version_clock.bump()
+
+
+def products_changed(product_id, *category_ids):
+    """
+    Called by the product write routes after committing, with the product
+    and the categories whose product list changed, so derived in-memory
+    data is refreshed.
+    """
+    related_products.invalidate(*(int(category_id) for category_id in category_ids))
+    serializers.forget_product(product_id)
+    catalog_changed()
+
+
+def get_product(product_id):
+    row = product_listing_query().filter(ProductListing.id == product_id).first()
+    return serializers.product_to_dict(row) if row else None
+
+
+def product_json(product_id):
+    row = product_listing_query().filter(ProductListing.id == product_id).first()
+    return serializers.product_fragments.encode(row) if row else None
+
+
+def products_by_ids_json(ids):
+    ids = list(ids)
+    if not ids:
+        return serializers.json_array([])
+    query = product_listing_query().filter(ProductListing.id.in_(ids)).order_by(ProductListing.id)
+    return serializers.encode_products(query)
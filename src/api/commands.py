@@ -1,6 +1,16 @@
 
+import json
+import os
+import time
+from datetime import timedelta
+from base64 import b64encode
 import click
-from api.models import db, User
+from werkzeug.security import generate_password_hash
+from api.models import db, User, OTP
+from api.importer import CatalogImporter
+from api.otp import otp_store
+from api.replica import sync_sqlite
+from api import search, benchmarks, uploads, catalog, fixtures, indexes, inventory, listing, passwords
 
 """
 In this file, you can add as many commands as you want using the @app.cli.command decorator
@@ -18,17 +28,238 @@ def setup_commands(app):
     @click.argument("count") # argument of out command
     def insert_test_users(count):
         print("Creating test users")
+        users = []
         for x in range(1, int(count) + 1):
-            user = User()
-            user.email = "test_user" + str(x) + "@test.com"
-            user.password = "123456"
-            user.is_active = True
-            db.session.add(user)
-            db.session.commit()
-            print("User: ", user.email, " created.")
+            # same password scheme as /register, the password is 123456
+            salt = b64encode(os.urandom(32)).decode("utf-8")
+            users.append({
+                "name": "Test",
+                "lastname": "User " + str(x),
+                "email": "test_user" + str(x) + "@test.com",
+                "password": generate_password_hash(f"123456{salt}", method=passwords.METHOD),
+                "salt": salt,
+                "admin": False,
+            })
+        db.session.execute(User.__table__.insert(), users)
+        db.session.commit()
 
         print("All test users created")
 
     @app.cli.command("insert-test-data")
-    def insert_test_data():
-        pass
\ No newline at end of file
+    @click.option("--orders", default=10000, help="orders to create, e.g. 10000, 100000 or 1000000")
+    @click.option("--users", default=None, type=int, help="defaults to orders / 10")
+    @click.option("--products", default=None, type=int, help="defaults to orders / 20")
+    @click.option("--seed", default=42, help="same seed, same data")
+    @click.option("--batch-size", default=5000, help="rows per INSERT")
+    def insert_test_data(orders, users, products, seed, batch_size):
+        """ Fills the database with seeded synthetic users, catalog, stock and orders """
+        started = time.perf_counter()
+        counts = fixtures.generate(orders, users, products, seed, batch_size)
+        print(", ".join(f"{value} {key}" for key, value in counts.items() if key != "first_user_id"))
+        print(f"Done in {time.perf_counter() - started:.1f}s, every user's password is {fixtures.PASSWORD}")
+
+    @app.cli.command("import-catalog")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--batch-size", default=1000, help="products per INSERT and commit")
+    @click.option("--upload-workers", default=8, help="photos uploaded in parallel")
+    @click.option("--images-dir", default=None, help="where relative photo paths are read from")
+    @click.option("--resume", is_flag=True, help="skip the records committed by a previous run")
+    def import_catalog(path, batch_size, upload_workers, images_dir, resume):
+        """ Imports products from a CSV or JSONL file, e.g. $ flask import-catalog products.csv """
+        importer = CatalogImporter(path, batch_size, upload_workers, images_dir)
+        started = time.perf_counter()
+        try:
+            count = importer.run(resume=resume)
+        except Exception as e:
+            raise click.ClickException(f"{e}\nFix the file and run again with --resume to continue")
+        print(f"Imported {count} products in {time.perf_counter() - started:.1f}s")
+
+    @app.cli.command("search-index")
+    def search_index():
+        """ Refills the SQLite full-text index behind /api/products/search from the products """
+        if not search.rebuild_sqlite_index():
+            raise click.ClickException("no products_fts to refill: the search indexes come from `flask db upgrade`")
+        print("Search index refilled")
+
+    @app.cli.command("rebuild-listing")
+    def rebuild_listing():
+        """ Refills the product_listing table behind the product listings from the products """
+        count = listing.rebuild()
+        catalog.catalog_changed()
+        print(f"{count} products in the listing")
+
+    @app.cli.command("stamp-baseline")
+    def stamp_baseline():
+        """ Marks a database created before the migrations existed as being at 0001_baseline """
+        tables = set(db.inspect(db.engine).get_table_names())
+        if "alembic_version" in tables or "users" not in tables:
+            print("Nothing to stamp")
+            return
+        from flask_migrate import stamp
+        stamp(revision="0001_baseline")
+        print("Stamped 0001_baseline, `flask db upgrade` applies the rest")
+
+    @app.cli.command("ensure-indexes")
+    def ensure_indexes():
+        """ Creates the indexes declared on the models that the database is missing """
+        # the unique email index needs one code per email
+        if db.inspect(db.engine).has_table(OTP.__tablename__):
+            otp_store.keep_latest()
+        indexes.ensure_indexes(report=lambda name: print(f"  {name}"))
+        print("Indexes ready")
+
+    @app.cli.command("check-indexes")
+    @click.option("--verbose", is_flag=True, help="print every query plan")
+    def check_indexes(verbose):
+        """ Runs EXPLAIN on the hot route queries and fails on sequential scans """
+        failed = []
+        for name, (plan, scans) in indexes.explain_hot_queries().items():
+            print(f"{'SEQ SCAN' if scans else 'ok':<9}{name}")
+            for line in plan if verbose else scans:
+                print(f"           {line}")
+            if scans:
+                failed.append(name)
+        if failed:
+            raise click.ClickException(f"sequential scans in: {', '.join(failed)}")
+
+    @app.cli.command("stock-reconcile")
+    @click.option("--fix", is_flag=True, help="set the amounts that differ back to their ledger balance")
+    def stock_reconcile(fix):
+        """ Opens the stock ledger of products that have none and checks every amount against its ledger """
+        opened = inventory.open_balances_after(0)
+        db.session.commit()
+        print(f"{opened} ledgers opened")
+        found = inventory.mismatches()
+        for product_id, amount, balance in found:
+            print(f"  product {product_id}: amount {amount}, ledger {balance}")
+        if found and fix:
+            inventory.apply_ledger([product_id for product_id, _, _ in found])
+            db.session.commit()
+            catalog.catalog_changed()
+            print(f"{len(found)} amounts set from the ledger")
+        elif found:
+            raise click.ClickException(f"{len(found)} products differ from their ledger, run with --fix")
+        else:
+            print("Every amount matches its ledger")
+
+    @app.cli.command("bench-order-history")
+    @click.option("--sizes", default="10,100,1000", help="comma separated order counts")
+    @click.option("--items", default=5, help="items per order")
+    @click.option("--repeat", default=20, help="requests per measurement")
+    def bench_order_history(sizes, items, repeat):
+        """ Shows GET /api/orders latency and query count as the order history grows """
+        benchmarks.bench_order_history(app, [int(size) for size in sizes.split(",")], items, repeat)
+
+    @app.cli.command("bench-order-idempotency")
+    @click.option("--threads", default=8, help="parallel retries of the same request")
+    def bench_order_idempotency(threads):
+        """ Times one order sent with the same Idempotency-Key from parallel threads """
+        benchmarks.bench_order_idempotency(app, threads)
+
+    @app.cli.command("bench-stock-contention")
+    @click.option("--threads", default=16, help="clients checking out at once")
+    @click.option("--orders", default=400, help="orders to place")
+    @click.option("--products", default=5, help="products the orders compete for")
+    @click.option("--stock", default=100, help="units of each product")
+    def bench_stock_contention(threads, orders, products, stock):
+        """ Times concurrent orders for a few scarce products """
+        benchmarks.bench_stock_contention(app, threads, orders, products, stock)
+
+    @app.cli.command("bench-stream-memory")
+    @click.option("--sizes", default="1000,10000,100000", help="comma separated row counts")
+    @click.option("--buffered-max", default=100000, help="largest size to also fetch without ?stream=1")
+    def bench_stream_memory(sizes, buffered_max):
+        """ Compares peak memory of a streamed and a buffered product listing """
+        benchmarks.bench_stream_memory(app, [int(size) for size in sizes.split(",")], buffered_max)
+
+    @app.cli.command("bench-serializers")
+    @click.option("--rows", default=10000, help="products in the listing")
+    @click.option("--repeat", default=5, help="runs per variant")
+    def bench_serializers(rows, repeat):
+        """ Compares Product.serialize() + json with the column row and cached fragment serializers """
+        benchmarks.bench_serializers(rows, repeat)
+
+    @app.cli.command("bench-endpoints")
+    @click.option("--orders", default=10000, help="fixture size, used when the database has no fixture data yet")
+    @click.option("--seed", default=42, help="fixture and request seed")
+    @click.option("--repeat", default=50, help="measured requests per endpoint")
+    @click.option("--only", default="", help="comma separated endpoint names")
+    @click.option("--output", default="bench-results.json", help="where to write this run")
+    @click.option("--baseline", default="bench-baseline.json", help="previous run to compare with")
+    @click.option("--threshold", default=0.25, help="allowed p95 slowdown, as a fraction of the baseline")
+    @click.option("--update-baseline", is_flag=True, help="save this run as the new baseline")
+    def bench_endpoints(orders, seed, repeat, only, output, baseline, threshold, update_baseline):
+        """ Measures latency percentiles, throughput and SQL per request of the main endpoints """
+        only = {name for name in only.split(",") if name}
+        results = benchmarks.bench_endpoints(app, orders, seed, repeat, only)
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {output}")
+        if update_baseline:
+            with open(baseline, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Baseline saved to {baseline}")
+            return
+        if not os.path.exists(baseline):
+            print(f"No baseline at {baseline}, run with --update-baseline to create one")
+            return
+        with open(baseline) as f:
+            found = benchmarks.regressions(results, json.load(f), threshold)
+        if found:
+            raise click.ClickException("regressions against " + baseline + ":\n  " + "\n  ".join(found))
+        print(f"OK: no regressions against {baseline}")
+
+    @app.cli.command("bench-login")
+    @click.option("--concurrency", default=8, help="clients logging in at once")
+    @click.option("--logins", default=64, help="logins per run")
+    @click.option("--workers", default="0,2", help="comma separated hash pool sizes, 0 hashes inline")
+    @click.option("--queue-size", default=None, type=int, help="hashes admitted at once, default 4 per worker")
+    def bench_login(concurrency, logins, workers, queue_size):
+        """ Measures login throughput and catalog latency under concurrent logins """
+        benchmarks.bench_login(app, concurrency, logins, [int(size) for size in workers.split(",")], queue_size)
+
+    @app.cli.command("sweep-uploads")
+    @click.option("--minutes", default=int(uploads.STALE_AFTER.total_seconds() // 60),
+                  help="uploads pending for longer than this are failed")
+    def sweep_uploads(minutes):
+        """ Fails the photo uploads left pending by a worker that died or was recycled """
+        swept = uploads.upload_pipeline.sweep(stale_after=timedelta(minutes=minutes))
+        print(f"{swept} pending uploads marked as failed")
+
+    @app.cli.command("sweep-otps")
+    @click.option("--batch-size", default=1000, help="rows deleted per transaction")
+    def sweep_otps(batch_size):
+        """ Deletes expired one-time passwords, run it from a cron job """
+        print(f"{otp_store.sweep(batch_size)} expired codes deleted")
+
+    @app.cli.command("bench-server")
+    @click.option("--modes", default="sync,gthread,gevent", help="comma separated gunicorn worker classes")
+    @click.option("--clients", default=16, help="concurrent clients")
+    @click.option("--duration", default=10, help="seconds of load per mode")
+    @click.option("--port", default=8200, help="port for the benchmarked server")
+    @click.option("--login-share", default=0.1, help="fraction of requests that are logins")
+    def bench_server(modes, clients, duration, port, login_share):
+        """ Compares gunicorn worker classes under mixed catalog and login load """
+        benchmarks.bench_server(app, modes.split(","), clients, duration, port, login_share)
+
+    @app.cli.command("check-import-time")
+    @click.option("--budget-ms", default=int(os.getenv("IMPORT_TIME_BUDGET_MS", 800)),
+                  help="allowed time to import wsgi and build the app")
+    @click.option("--runs", default=3, help="measurements, the fastest one counts")
+    def check_import_time(budget_ms, runs):
+        """ Prints how long worker boot imports take, and the lazy modules it loads eagerly """
+        benchmarks.print_import_time(app.root_path, budget_ms, runs)
+
+    @app.cli.command("replica-sync")
+    @click.option("--interval", default=0, help="keep copying every N seconds, 0 copies once")
+    def replica_sync(interval):
+        """ Copies a SQLite primary into its SQLite replica, for the local replica setup """
+        primary, replica = db.engine.url, db.engines.get("replica")
+        if replica is None or primary.get_backend_name() != "sqlite" or replica.url.get_backend_name() != "sqlite":
+            raise click.ClickException("needs DATABASE_URL and DATABASE_REPLICA_URL pointing to SQLite files")
+        while True:
+            sync_sqlite(primary.database, replica.url.database)
+            print(f"{replica.url.database} synced from {primary.database}")
+            if not interval:
+                return
+            time.sleep(interval)
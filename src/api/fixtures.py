@@ -0,0 +1,161 @@
+"""
+Deterministic synthetic data for local benchmarking, used by
+`flask insert-test-data` and the benchmark suite.
+
+The same seed and sizes always produce the same rows. Order volume is
+skewed the way real traffic is: product popularity follows a Zipf curve
+and a small share of users place most of the orders. Rows are written
+with executemany batches and explicit ids (appended after the current
+max id), so no per-row round trips are needed; on PostgreSQL the id
+sequences are moved past the new rows afterwards.
+
+Every generated user has the password 123456.
+"""
+import random
+import time
+from base64 import b64encode
+from datetime import datetime, timedelta
+from itertools import accumulate
+from sqlalchemy import func, text
+from werkzeug.security import generate_password_hash
+from api import catalog, inventory, listing, passwords
+from api.models import db, User, Category, Subcategory, Product, Stock, Order, OrderDetail
+
+PASSWORD = "123456"
+CATEGORY_NAMES = ["Remeras", "Pantalones", "Camperas", "Calzado", "Accesorios", "Buzos", "Vestidos", "Deportes"]
+SUBCATEGORY_NAMES = ["Hombre", "Mujer", "Niños", "Unisex"]
+
+
+def next_id(model):
+    return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+
+def insert_batches(table, rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+
+
+def reset_sequences(*models):
+    if db.engine.dialect.name != "postgresql":
+        return
+    for model in models:
+        table = model.__tablename__
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"
+        ))
+
+
+def zipf_weights(count, exponent):
+    return list(accumulate(1 / (rank ** exponent) for rank in range(1, count + 1)))
+
+
+def generate(orders=10000, users=None, products=None, seed=42, batch_size=5000, report=print):
+    """Inserts users, catalog, stock, orders and details; returns the row counts."""
+    rng = random.Random(seed)
+    users = users or max(10, orders // 10)
+    products = products or max(50, orders // 20)
+    started = time.perf_counter()
+
+    # catalog
+    first_category = next_id(Category)
+    categories = [{"id": first_category + i, "name": name} for i, name in enumerate(CATEGORY_NAMES)]
+    first_subcategory = next_id(Subcategory)
+    subcategories = [
+        {"id": first_subcategory + i * len(SUBCATEGORY_NAMES) + j, "name": name, "category_id": category["id"]}
+        for i, category in enumerate(categories)
+        for j, name in enumerate(SUBCATEGORY_NAMES)
+    ]
+    db.session.execute(Category.__table__.insert(), categories)
+    db.session.execute(Subcategory.__table__.insert(), subcategories)
+
+    first_product = next_id(Product)
+    product_rows = []
+    for i in range(products):
+        subcategory = rng.choice(subcategories)
+        product_rows.append({
+            "id": first_product + i,
+            "name": f"{rng.choice(CATEGORY_NAMES)} {subcategory['name']} modelo {first_product + i}",
+            "public_id": f"fixture/{first_product + i}",
+            "photo": f"https://picsum.photos/seed/{first_product + i}/400/400",
+            "amount": float(rng.randint(0, 500)),
+            "price": float(rng.randint(5, 300) * 100),
+            "category_id": subcategory["category_id"],
+            "subcategory_id": subcategory["id"],
+        })
+    insert_batches(Product.__table__, product_rows, batch_size)
+    listing.add_products_after(first_product - 1)
+    insert_batches(Stock.__table__, (
+        {"products_id": product["id"], "quantity": int(product["amount"]), "date_in": datetime.now(),
+         "reason": inventory.INITIAL}
+        for product in product_rows
+    ), batch_size)
+    db.session.commit()
+    report(f"{len(categories)} categories, {len(subcategories)} subcategories, {products} products")
+
+    # users, one shared salt so the password is hashed once
+    salt = b64encode(rng.randbytes(32)).decode("utf-8")
+    password = generate_password_hash(f"{PASSWORD}{salt}", method=passwords.METHOD)
+    first_user = next_id(User)
+    insert_batches(User.__table__, (
+        {"id": first_user + i, "name": f"Usuario{first_user + i}", "lastname": "Fixture",
+         "email": f"user{first_user + i}@example.com", "password": password, "salt": salt, "admin": False}
+        for i in range(users)
+    ), batch_size)
+    db.session.commit()
+    report(f"{users} users")
+
+    # orders: heavy buyers and popular products
+    product_weights = zipf_weights(products, 1.1)
+    buyer_weights = zipf_weights(users, 0.8)
+    product_ids = [product["id"] for product in product_rows]
+    prices = {product["id"]: product["price"] for product in product_rows}
+    names = {product["id"]: product["name"] for product in product_rows}
+    user_ids = list(range(first_user, first_user + users))
+    buyer_order = rng.sample(user_ids, users)
+    now = datetime.now()
+
+    first_order = next_id(Order)
+    details = 0
+    for start in range(0, orders, batch_size):
+        order_rows, detail_rows = [], []
+        for order_id in range(first_order + start, first_order + min(orders, start + batch_size)):
+            items = set(rng.choices(product_ids, cum_weights=product_weights, k=rng.randint(1, 5)))
+            lines = [(product_id, rng.randint(1, 3)) for product_id in items]
+            order_rows.append({
+                "id": order_id,
+                "user_id": rng.choices(buyer_order, cum_weights=buyer_weights)[0],
+                "date": now - timedelta(minutes=rng.randint(0, 365 * 24 * 60)),
+                "price": sum(prices[product_id] * quantity for product_id, quantity in lines),
+                "address": "Direccion de Prueba",
+                "deliver_address": "Direccion de Prueba",
+                "status": "OK",
+            })
+            detail_rows.extend({
+                "order_id": order_id, "product_id": product_id, "name": names[product_id],
+                "quantity": quantity, "price": prices[product_id],
+            } for product_id, quantity in lines)
+        db.session.execute(Order.__table__.insert(), order_rows)
+        db.session.execute(OrderDetail.__table__.insert(), detail_rows)
+        db.session.commit()
+        details += len(detail_rows)
+        done = start + len(order_rows)
+        report(f"{done} orders ({done / (time.perf_counter() - started):.0f} orders/s)")
+
+    reset_sequences(Category, Subcategory, Product, User, Order)
+    db.session.commit()
+    catalog.catalog_changed()
+    return {
+        "categories": len(categories),
+        "subcategories": len(subcategories),
+        "products": products,
+        "users": users,
+        "orders": orders,
+        "order_details": details,
+        "first_user_id": first_user,
+    }
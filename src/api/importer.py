@@ -0,0 +1,148 @@
+"""
+Bulk catalog import, used by `flask import-catalog`.
+
+Reads a CSV (header row) or JSONL file one record at a time. Each record
+needs name, price, amount, category and subcategory, and may have a
+photo: an http(s) url is stored as is, anything else is a file path
+(relative to the images directory) that gets uploaded with the configured
+uploader, several at a time. Categories and subcategories are looked up
+by name and created when missing. Products are inserted with one
+executemany per batch and a checkpoint file next to the input records how
+many records are committed, so a failed import can be resumed.
+"""
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from api import catalog, inventory, listing
+from api.models import db, Product, Category, Subcategory
+from api.uploads import uploader_from_env
+
+REQUIRED_FIELDS = ("name", "price", "amount", "category", "subcategory")
+
+
+def read_records(path):
+    """Yields the records of a .csv or .jsonl file, in order."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class CatalogImporter:
+
+    def __init__(self, path, batch_size=1000, upload_workers=8, images_dir=None, uploader=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.upload_workers = upload_workers
+        self.images_dir = images_dir or os.path.dirname(os.path.abspath(path))
+        self.uploader = uploader or uploader_from_env()
+        self.checkpoint_path = f"{path}.progress"
+        self.load_lookups()
+
+    def load_lookups(self):
+        self.categories = {name: id for id, name in db.session.query(Category.id, Category.name)}
+        self.subcategories = {
+            (category_id, name): id
+            for id, name, category_id in db.session.query(Subcategory.id, Subcategory.name, Subcategory.category_id)
+        }
+
+    def checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def save_checkpoint(self, done):
+        with open(self.checkpoint_path, "w") as f:
+            f.write(str(done))
+
+    def category_id(self, name):
+        if name not in self.categories:
+            category = Category(name=name)
+            db.session.add(category)
+            db.session.flush()
+            self.categories[name] = category.id
+        return self.categories[name]
+
+    def subcategory_id(self, category_id, name):
+        key = (category_id, name)
+        if key not in self.subcategories:
+            subcategory = Subcategory(name=name, category_id=category_id)
+            db.session.add(subcategory)
+            db.session.flush()
+            self.subcategories[key] = subcategory.id
+        return self.subcategories[key]
+
+    def upload(self, photo):
+        if not photo or photo.startswith(("http://", "https://")):
+            return photo or "", ""
+        path = os.path.join(self.images_dir, photo)
+        with open(path, "rb") as f:
+            url, public_id = self.uploader.upload(f.read(), os.path.basename(path))
+        return url, public_id
+
+    def build_rows(self, records, pool):
+        for number, record in records:
+            missing = [field for field in REQUIRED_FIELDS if not record.get(field)]
+            if missing:
+                raise ValueError(f"record {number}: missing {', '.join(missing)}")
+        photos = pool.map(self.upload, [record.get("photo") for _, record in records])
+        rows = []
+        for (_, record), (photo, public_id) in zip(records, photos):
+            category_id = self.category_id(record["category"])
+            rows.append({
+                "name": record["name"],
+                "photo": photo,
+                "public_id": record.get("public_id") or public_id,
+                "amount": float(record["amount"]),
+                "price": float(record["price"]),
+                "category_id": category_id,
+                "subcategory_id": self.subcategory_id(category_id, record["subcategory"]),
+            })
+        return rows
+
+    def run(self, resume=False, report=print):
+        skip = self.checkpoint() if resume else 0
+        if skip:
+            report(f"Resuming after {skip} records")
+        done = skip
+        started = time.perf_counter()
+        batch = []
+        with ThreadPoolExecutor(self.upload_workers) as pool:
+            for number, record in enumerate(read_records(self.path), start=1):
+                if number <= skip:
+                    continue
+                batch.append((number, record))
+                if len(batch) == self.batch_size:
+                    done = self.write_batch(batch, pool, done, started, skip, report)
+                    batch = []
+            if batch:
+                done = self.write_batch(batch, pool, done, started, skip, report)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        catalog.catalog_changed()
+        return done - skip
+
+    def write_batch(self, batch, pool, done, started, skip, report):
+        try:
+            last_id = db.session.query(db.func.max(Product.id)).scalar() or 0
+            db.session.execute(Product.__table__.insert(), self.build_rows(batch, pool))
+            listing.add_products_after(last_id)
+            inventory.open_balances_after(last_id)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # categories created in the failed batch were rolled back too
+            self.load_lookups()
+            raise
+        done += len(batch)
+        self.save_checkpoint(done)
+        elapsed = time.perf_counter() - started
+        report(f"{done} records imported ({(done - skip) / elapsed:.0f} rows/s)")
+        return done
@@ -0,0 +1,108 @@
+"""
+Indexes for the hot query paths, and a check that they are used.
+
+The indexes are declared on the models (index=True or __table_args__) and
+created by the migrations, like any other schema change. On a large
+PostgreSQL database, run ensure_indexes() (`flask ensure-indexes`) before
+`flask db upgrade`: it builds them with CREATE INDEX CONCURRENTLY so the
+tables are not locked, and the migration then skips the ones that exist. explain_hot_queries() runs EXPLAIN on the query behind each hot
+route and flags sequential scans; on PostgreSQL seq scans are disabled
+for the check, so one that still shows up means no index fits the query.
+"""
+import re
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from api import catalog
+from api.models import db, Category, Subcategory, Order, OrderDetail, ProductListing, Stock, OTP
+
+
+# CREATE INDEX or CREATE UNIQUE INDEX, CONCURRENTLY goes right after it
+CREATE_INDEX_RE = re.compile(r"^(CREATE (?:UNIQUE )?INDEX)")
+
+
+def model_indexes():
+    for table in db.metadata.sorted_tables:
+        yield from sorted(table.indexes, key=lambda index: index.name)
+
+
+def invalid_indexes(connection):
+    """Names of the PostgreSQL indexes marked invalid (pg_index.indisvalid)."""
+    return {name for (name,) in connection.execute(text(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid"))}
+
+
+def ensure_indexes(report=print):
+    """
+    Creates every index declared on the models that the database does not
+    have yet. Indexes on tables or columns the migrations have not added
+    yet are left to the migration.
+    """
+    engine = db.engine
+    postgresql = engine.dialect.name == "postgresql"
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    # CONCURRENTLY cannot run inside a transaction, and waits for every open one
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        invalid = invalid_indexes(connection) if postgresql else set()
+        for index in model_indexes():
+            if index.table.name not in tables or not {column.name for column in index.columns} <= {
+                    column["name"] for column in inspector.get_columns(index.table.name)}:
+                continue
+            statement = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+            if postgresql:
+                if index.name in invalid:
+                    # left by a CONCURRENTLY build that failed; IF NOT EXISTS would skip it for good
+                    connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"))
+                statement = CREATE_INDEX_RE.sub(r"\1 CONCURRENTLY", statement, count=1)
+            connection.execute(text(statement))
+            report(f"{index.name} on {index.table.name}")
+
+
+def hot_queries():
+    """name -> the query one of the hot routes runs, with sample values."""
+    return {
+        "products by category": catalog.filtered_products(category_id=1).order_by(ProductListing.id).limit(21),
+        "products by category and subcategory": catalog.filtered_products(
+            category_id=1, subcategory_id=1).order_by(ProductListing.id).limit(21),
+        "related products pool": db.session.query(ProductListing.id)
+            .filter(ProductListing.category_id == 1).order_by(ProductListing.id),
+        "listing subcategory rename": db.session.query(ProductListing.id).filter(ProductListing.subcategory_id == 1),
+        "order history page": db.session.query(Order.id, Order.price, Order.date)
+            .filter(Order.user_id == 1).order_by(Order.id).limit(21),
+        "order history details": db.session.query(OrderDetail.order_id, OrderDetail.product_id)
+            .filter(OrderDetail.order_id.in_([1, 2, 3])).order_by(OrderDetail.order_id, OrderDetail.id),
+        "product order details": db.session.query(OrderDetail.id).filter(OrderDetail.product_id == 1),
+        "product stock ledger": db.session.query(Stock.id).filter(Stock.products_id == 1).order_by(Stock.id),
+        "verify otp": OTP.query.filter(OTP.email == "user@example.com", OTP.otp == "123456",
+                                       OTP.expires_at > datetime(2000, 1, 1)),
+        "category by name": Category.query.filter_by(name="Remeras"),
+        "subcategory by name": Subcategory.query.filter_by(name="Hombre"),
+    }
+
+
+def explain(query):
+    dialect = db.engine.dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+    if dialect.name == "sqlite":
+        return [row[-1] for row in db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+    db.session.execute(text("SET LOCAL enable_seqscan = off"))
+    return [row[0] for row in db.session.execute(text(f"EXPLAIN {sql}"))]
+
+
+def is_seq_scan(line):
+    line = line.strip()
+    # SQLite: "SCAN products [USING ... INDEX]" reads the whole table or index, "SEARCH" does not
+    return "Seq Scan" in line or line.startswith("SCAN ")
+
+
+def explain_hot_queries():
+    """Returns {name: (plan lines, seq scan lines)}."""
+    plans = {}
+    try:
+        for name, query in hot_queries().items():
+            plan = explain(query)
+            plans[name] = (plan, [line for line in plan if is_seq_scan(line)])
+    finally:
+        db.session.rollback()
+    return plans
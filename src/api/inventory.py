@@ -0,0 +1,197 @@
+"""
+Stock ledger and available quantities.
+
+Every stock movement is a new row in `stock` (Stock) with a signed
+quantity and a reason: "initial" and "restock" bring units in,
+"adjustment" is an edit of the amount in update_product, "order" takes
+them out with the id of the order that sold them, and "closing" takes
+out what is left of a deleted product. Rows are never changed or
+deleted afterwards, so the ledger is the full history of a product, and
+Product.amount caches its sum so checkout never has to add it up.
+Amounts are whole units: parse_amount() refuses anything else with a 400.
+
+reserve() takes all the lines of an order out of stock with one
+conditional UPDATE:
+    UPDATE products SET amount = amount + CASE id WHEN 7 THEN -2 ... END
+    WHERE id IN (7, ...) AND amount + CASE id WHEN 7 THEN -2 ... END >= 0
+The database locks each row it changes and checks the condition against
+the latest committed amount, so two checkouts can never both take the
+last unit. If fewer rows changed than the order has products, something
+ran out: the order is rolled back and answered with a 409. Nothing is
+read or locked beforehand, so orders for different products never wait
+on each other.
+
+An order only updates the amounts of its products in product_listing,
+in the same transaction; it does not bump the catalog version, so cached
+listings may show amounts up to CATALOG_STOCK_TTL seconds old (see
+api/cache.py). Checkout is what enforces the limit.
+
+`flask stock-reconcile` opens the ledger of products created before it
+existed and checks every Product.amount against its ledger.
+"""
+from collections import defaultdict
+from datetime import datetime
+from math import isfinite
+from sqlalchemy import Integer, case, cast, func, literal, select, update
+from api import listing
+from api.models import db, Product, Stock
+from api.utils import APIException
+
+INITIAL = "initial"
+RESTOCK = "restock"
+ADJUSTMENT = "adjustment"
+ORDER = "order"
+CLOSING = "closing"
+
+
+def parse_amount(amount):
+    """The available quantity sent by a product form as an int, or a 400 APIException."""
+    try:
+        value = float(amount)
+    except (TypeError, ValueError):
+        value = -1.0
+    if not value.is_integer() or value < 0:
+        raise APIException("amount debe ser un entero mayor o igual a 0", status_code=400)
+    return int(value)
+
+
+def order_quantities(items):
+    """
+    {product_id: units} for the lines of an order; a product may be on
+    several lines. Every line also needs the price and name its order
+    detail is written with, or a 400 APIException is raised.
+    """
+    quantities = defaultdict(int)
+    for item in items:
+        try:
+            product_id, quantity = int(item["product_id"]), int(item["quantity"])
+            price, name = float(item["price"]), item["name"]
+        except (KeyError, TypeError, ValueError):
+            raise APIException("Cada item necesita product_id, quantity, price y name", status_code=400)
+        if not (isfinite(price) and price >= 0 and isinstance(name, str) and 0 < len(name) <= 120):
+            raise APIException("Precio o nombre inválido", status_code=400)
+        if quantity < 1:
+            raise APIException("La cantidad debe ser mayor a 0", status_code=400)
+        quantities[product_id] += quantity
+    return dict(quantities)
+
+
+def record(quantities, reason, order_id=None):
+    """Appends one ledger row per product of `quantities` ({product_id: signed units})."""
+    now = datetime.now()
+    db.session.execute(Stock.__table__.insert(), [
+        {"products_id": product_id, "quantity": quantity, "date_in": now, "reason": reason, "order_id": order_id}
+        for product_id, quantity in quantities.items()
+    ])
+
+
+def _move(quantities, reason, order_id=None, condition=None):
+    """Adds `quantities` to the products' amounts in one UPDATE; returns the rows changed."""
+    delta = case(quantities, value=Product.id)
+    statement = update(Product.__table__).where(Product.id.in_(quantities)).values(amount=Product.amount + delta)
+    if condition is not None:
+        statement = statement.where(condition(delta))
+    changed = db.session.execute(statement).rowcount
+    if changed == len(quantities):
+        record(quantities, reason, order_id)
+        listing.sync_amounts(*quantities)
+    return changed
+
+
+def reserve(order_id, items):
+    """
+    Takes the units of every line of the order out of stock, in the
+    caller's transaction. When a product has fewer units than asked for,
+    the transaction is rolled back and a 409 APIException lists what is
+    short.
+    """
+    quantities = order_quantities(items)
+    taken = {product_id: -quantity for product_id, quantity in quantities.items()}
+    # delta is negative, so amount + delta >= 0 means there are enough units
+    if _move(taken, ORDER, order_id, condition=lambda delta: Product.amount + delta >= 0) != len(taken):
+        db.session.rollback()
+        raise APIException("Stock insuficiente", status_code=409, payload={"items": shortages(quantities)})
+
+
+def shortages(quantities):
+    available = dict(db.session.query(Product.id, Product.amount).filter(Product.id.in_(quantities)))
+    return [
+        {"product_id": product_id, "requested": quantity, "available": available.get(product_id, 0)}
+        for product_id, quantity in quantities.items()
+        if available.get(product_id, 0) < quantity
+    ]
+
+
+def restock(product_id, quantity, reason=RESTOCK):
+    _move({int(product_id): int(quantity)}, reason)
+
+
+def open_stock(product_id, amount):
+    """First ledger row of a new product, whose amount (from parse_amount()) is already set."""
+    if amount:
+        record({int(product_id): amount}, INITIAL)
+
+
+def balance(product_id):
+    return db.session.query(func.coalesce(func.sum(Stock.quantity), 0)).filter(Stock.products_id == product_id).scalar()
+
+
+def set_available(product_id, amount):
+    """
+    Sets the available quantity of a product to `amount` (from
+    parse_amount()), recording the difference to its ledger balance as an
+    adjustment.
+    """
+    # orders for this product wait until the edit commits
+    db.session.query(Product.id).filter(Product.id == product_id).with_for_update().scalar()
+    difference = amount - balance(product_id)
+    if difference:
+        record({int(product_id): difference}, ADJUSTMENT)
+    db.session.execute(update(Product.__table__).where(Product.id == product_id).values(amount=amount))
+    listing.sync_amounts(product_id)
+
+
+def open_balances_after(product_id=0):
+    """Gives the products with an id above `product_id` and no ledger yet an initial row with their amount."""
+    has_ledger = select(Stock.id).where(Stock.products_id == Product.id).exists()
+    products = (
+        select(Product.id, cast(Product.amount, Integer), literal(datetime.now()), literal(INITIAL))
+        .where(Product.id > product_id, ~has_ledger, Product.amount != 0)
+    )
+    return db.session.execute(Stock.__table__.insert().from_select(
+        ["products_id", "quantity", "date_in", "reason"], products)).rowcount
+
+
+def close_stock(product_id):
+    """Takes the units left of a product that is being deleted out of its ledger, which is kept."""
+    left = balance(product_id)
+    if left:
+        record({int(product_id): -left}, CLOSING)
+
+
+def mismatches():
+    """(product_id, amount, ledger balance) for every product whose amount differs from its ledger."""
+    balances = (
+        select(Stock.products_id, func.sum(Stock.quantity).label("balance"))
+        .group_by(Stock.products_id)
+        .subquery()
+    )
+    balance = func.coalesce(balances.c.balance, 0)
+    return (
+        db.session.query(Product.id, Product.amount, balance)
+        .outerjoin(balances, balances.c.products_id == Product.id)
+        .filter(Product.amount != balance)
+        .order_by(Product.id)
+        .all()
+    )
+
+
+def apply_ledger(product_ids):
+    """Sets the amount of the products back to their ledger balance."""
+    balance = (
+        select(func.coalesce(func.sum(Stock.quantity), 0))
+        .where(Stock.products_id == Product.id)
+        .scalar_subquery()
+    )
+    db.session.execute(update(Product.__table__).where(Product.id.in_(product_ids)).values(amount=balance))
+    listing.sync_amounts(*product_ids)
@@ -0,0 +1,117 @@
+"""
+Denormalized product listing.
+
+product_listing holds one row per product with exactly the fields of
+Product.serialize(), the category and subcategory names included, so the
+listing routes read a single table with no joins. It is a plain table
+rather than a PostgreSQL materialized view: it works on SQLite too, and a
+write only touches the rows it changed instead of refreshing everything.
+
+Every write to the catalog updates it in the same transaction, before the
+commit, with INSERT … SELECT … ON CONFLICT (id) DO UPDATE (PostgreSQL and
+SQLite), so two transactions syncing the same product, like an upload
+finishing while the product is edited, both succeed instead of one
+failing on the primary key:
+    sync_products(id, ...)      product added, edited or deleted
+    sync_category(id)           every product of a category, for bulk writes
+    add_products_after(id)      products bulk inserted with ids above `id`
+    sync_amounts(id, ...)       stock moved (api/inventory.py)
+    rename_category(id, name), rename_subcategory(id, name)
+
+`flask rebuild-listing` rebuilds the whole table from products.
+"""
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from api.models import db, Product, Category, Subcategory, ProductListing
+from api.serializers import PRODUCT_FIELDS
+
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def source():
+    """The products joined with their names, in PRODUCT_FIELDS order."""
+    return (
+        select(
+            Product.id,
+            Product.name,
+            Product.photo,
+            Product.amount,
+            Product.category_id,
+            Product.subcategory_id,
+            Product.price,
+            Category.name.label("category"),
+            Subcategory.name.label("subcategory"),
+        )
+        .join(Category, Product.category_id == Category.id)
+        .join(Subcategory, Product.subcategory_id == Subcategory.id)
+    )
+
+
+def _copy(select_products):
+    result = db.session.execute(
+        insert(ProductListing.__table__).from_select(PRODUCT_FIELDS, select_products))
+    return result.rowcount
+
+
+def _upsert(select_products, insert_):
+    statement = insert_(ProductListing.__table__).from_select(PRODUCT_FIELDS, select_products)
+    statement = statement.on_conflict_do_update(
+        index_elements=[ProductListing.id],
+        set_={field: statement.excluded[field] for field in PRODUCT_FIELDS if field != "id"},
+    )
+    return db.session.execute(statement).rowcount
+
+
+def _sync(listing_condition, product_condition):
+    # pending ORM changes of the product have to be in the database before they are copied
+    db.session.flush()
+    insert_ = UPSERT_INSERTS.get(db.engine.dialect.name)
+    if insert_ is None:
+        db.session.execute(delete(ProductListing.__table__).where(listing_condition))
+        return _copy(source().where(product_condition))
+    count = _upsert(source().where(product_condition), insert_)
+    # rows of products that were deleted, or no longer match
+    db.session.execute(delete(ProductListing.__table__).where(
+        listing_condition, ProductListing.id.not_in(select(Product.id).where(product_condition))))
+    return count
+
+
+def sync_products(*product_ids):
+    """Copies the products again; ids that no longer exist are removed from the listing."""
+    ids = [int(product_id) for product_id in product_ids]
+    _sync(ProductListing.id.in_(ids), Product.id.in_(ids))
+
+
+def sync_category(category_id):
+    _sync(ProductListing.category_id == category_id, Product.category_id == category_id)
+
+
+def add_products_after(product_id):
+    """Copies the products with an id above `product_id`, for bulk inserts that did not get their ids back."""
+    return _sync(ProductListing.id > product_id, Product.id > product_id)
+
+
+def sync_amounts(*product_ids):
+    """Copies only the available quantity, with one UPDATE, for stock movements."""
+    available = select(Product.amount).where(Product.id == ProductListing.id).scalar_subquery()
+    db.session.execute(update(ProductListing.__table__)
+                       .where(ProductListing.id.in_([int(product_id) for product_id in product_ids]))
+                       .values(amount=available))
+
+
+def rename_category(category_id, name):
+    db.session.execute(update(ProductListing.__table__)
+                       .where(ProductListing.category_id == category_id).values(category=name))
+
+
+def rename_subcategory(subcategory_id, name):
+    db.session.execute(update(ProductListing.__table__)
+                       .where(ProductListing.subcategory_id == subcategory_id).values(subcategory=name))
+
+
+def rebuild():
+    """Refills the whole listing in one transaction; returns the number of rows."""
+    db.session.execute(delete(ProductListing.__table__))
+    count = _copy(source().order_by(Product.id))
+    db.session.commit()
+    return count
@@ -0,0 +1,141 @@
+"""
+Request and database instrumentation, exposed as Prometheus text on /metrics.
+
+Tracks per-route latency and status counts, requests in flight, SQL
+statement counts and time, and how long requests wait to get a database
+connection from the pool.
+
+With several gunicorn workers every process keeps its own counters, so
+gunicorn_config.py points PROMETHEUS_MULTIPROC_DIR at an empty directory
+before the app loads (it is read when prometheus_client is imported):
+each worker then writes its values there and /metrics adds up all of
+them, whichever worker answers. Without it the numbers cover only the
+process that serves the scrape, which is fine for `flask run`.
+"""
+import os
+import time
+from flask import Response, g, request, has_request_context
+
+# prometheus_client opens its files there as soon as a metric is created, also for
+# `flask` commands run with the server's environment
+if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess,
+)
+from sqlalchemy import event
+from api.models import db
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time to build the response, by route",
+    ["method", "route"], buckets=LATENCY_BUCKETS,
+)
+REQUESTS = Counter("http_requests_total", "Responses sent, by route and status", ["method", "route", "status"])
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests being handled right now",
+    ["method", "route"], multiprocess_mode="livesum",
+)
+SQL_STATEMENTS = Counter("db_statements_total", "SQL statements executed, by route", ["route"])
+SQL_SECONDS = Counter("db_statement_seconds_total", "Time spent in SQL statements, by route", ["route"])
+SQL_LATENCY = Histogram("db_statement_duration_seconds", "Duration of single SQL statements", buckets=SQL_BUCKETS)
+POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time to get a connection from the pool", buckets=POOL_WAIT_BUCKETS,
+)
+
+
+def current_route():
+    if not has_request_context():
+        return "<none>"
+    rule = request.url_rule
+    return rule.rule if rule is not None else "<unmatched>"
+
+
+def before_request():
+    g.metrics_route = current_route()
+    g.metrics_start = time.perf_counter()
+    IN_PROGRESS.labels(request.method, g.metrics_route).inc()
+
+
+def after_request(response):
+    observe(response.status_code)
+    return response
+
+
+def teardown_request(error):
+    if "metrics_route" not in g:
+        return
+    # after_request is skipped when the view raised an unhandled exception
+    observe(500)
+    IN_PROGRESS.labels(request.method, g.metrics_route).dec()
+
+
+def observe(status):
+    start = g.pop("metrics_start", None)
+    if start is None:
+        return
+    REQUEST_LATENCY.labels(request.method, g.metrics_route).observe(time.perf_counter() - start)
+    REQUESTS.labels(request.method, g.metrics_route, str(status)).inc()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    took = time.perf_counter() - conn.info["metrics_start"].pop()
+    route = current_route()
+    SQL_STATEMENTS.labels(route).inc()
+    SQL_SECONDS.labels(route).inc(took)
+    SQL_LATENCY.observe(took)
+
+
+def handle_error(context):
+    starts = context.connection.info.get("metrics_start") if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+    # every Connection gets its DBAPI connection through raw_connection(); wrapping it on
+    # the engine (not the pool) keeps working after dispose() replaces the pool
+    raw_connection = engine.raw_connection
+
+    def timed_raw_connection(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return raw_connection(*args, **kwargs)
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - start)
+
+    engine.raw_connection = timed_raw_connection
+
+
+def metrics_registry():
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics():
+    return Response(generate_latest(metrics_registry()), mimetype=CONTENT_TYPE_LATEST)
+
+
+def setup_metrics(app):
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+    with app.app_context():
+        for engine in db.engines.values():
+            instrument_engine(engine)
+    app.add_url_rule("/metrics", "metrics", metrics)
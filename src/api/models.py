@@ -1,8 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from api.replica import RoutingSession
 
 
-db = SQLAlchemy()
+# RoutingSession sends the reads of @read_replica views to the replica, if there is one
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 class User(db.Model):
     __tablename__ = "users"
@@ -14,6 +16,8 @@ class User(db.Model):
     salt = db.Column(db.String(180), nullable=False)
     created_at = db.Column(db.DateTime(timezone=True), default=db.func.now(), nullable=False)
     admin = db.Column(db.Boolean, default=False )
+    # epoch seconds until which this user's reads skip the replica, set by their writes (see api/replica.py)
+    read_primary_until = db.Column(db.Float)
     # is_active = db.Column(db.Boolean(), unique=False, nullable=False)
     orders = db.relationship("Order", backref="user")
     
@@ -39,16 +43,28 @@ class Order(db.Model):
      deliver_address = db.Column(db.String(180), nullable=False)
      status = db.Column(db.String(180), nullable=False)
      user_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+     # client supplied Idempotency-Key header, retries with the same key return this order
+     idempotency_key = db.Column(db.String(120))
      order_details = db.relationship("OrderDetail", backref = "order")
+     __table_args__ = (
+         db.UniqueConstraint("user_id", "idempotency_key", name="uq_orders_user_idempotency_key"),
+         # order history: WHERE user_id = ? ORDER BY id
+         db.Index("ix_orders_user_id_id", "user_id", "id"),
+     )
      
 class OrderDetail(db.Model):
     __tablename__ = "order_detail"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True, nullable=False) 
-    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), primary_key=True, nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey("products.id"), nullable=False)
     name = db.Column(db.String(120), nullable=False)
     quantity = db.Column(db.Integer, nullable=False) 
     price = db.Column(db.Float, nullable=False)
+    __table_args__ = (
+        # details of a page of orders: WHERE order_id IN (...) ORDER BY order_id, id
+        db.Index("ix_order_detail_order_id_id", "order_id", "id"),
+        db.Index("ix_order_detail_product_id", "product_id"),
+    )
     
 
 class Product(db.Model):
@@ -57,12 +73,27 @@ class Product(db.Model):
     name = db.Column(db.String(120), nullable=False)
     public_id = db.Column(db.String(200), nullable=False)
     photo = db.Column(db.String(200), nullable=False)
+    # units available to sell: the sum of the product's stock ledger, kept in step by api/inventory.py
     amount = db.Column(db.Float, nullable=False)
     price= db.Column(db.Float, nullable=False)
     category_id = db.Column(db.Integer, db.ForeignKey("categories.id"), nullable=False)
     subcategory_id = db.Column(db.Integer, db.ForeignKey("subcategories.id"), nullable=False)
+    # "pending" while the photo is being uploaded in the background, then "ready" or "failed"
+    image_status = db.Column(db.String(20), default="ready", server_default="ready", nullable=False)
+    # when the last photo was queued, how many tries it took and why it failed (see api/uploads.py)
+    image_queued_at = db.Column(db.DateTime)
+    image_attempts = db.Column(db.Integer)
+    image_error = db.Column(db.String(250))
     order_detail = db.relationship("OrderDetail", backref="product")
-    stock = db.relationship("Stock", backref="product")
+    # the ledger has no foreign key to products, it outlives deleted products
+    stock = db.relationship("Stock", primaryjoin="Product.id == foreign(Stock.products_id)",
+                            viewonly=True, backref="product")
+    __table_args__ = (
+        # listings by category (and subcategory) are paginated by id
+        db.Index("ix_products_category_id_id", "category_id", "id"),
+        db.Index("ix_products_category_id_subcategory_id_id", "category_id", "subcategory_id", "id"),
+        db.Index("ix_products_subcategory_id", "subcategory_id"),
+    )
     
     def serialize(self):
         return {
@@ -78,10 +109,30 @@ class Product(db.Model):
             
         }
     
+class ProductListing(db.Model):
+    # one row per product with the fields of Product.serialize(), so listings need no joins;
+    # written together with the product, see api/listing.py
+    __tablename__ = "product_listing"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(120), nullable=False)
+    photo = db.Column(db.String(200), nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    category_id = db.Column(db.Integer, nullable=False)
+    subcategory_id = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    category = db.Column(db.String(120), nullable=False)
+    subcategory = db.Column(db.String(120), nullable=False)
+    __table_args__ = (
+        db.Index("ix_product_listing_category_id_id", "category_id", "id"),
+        db.Index("ix_product_listing_category_id_subcategory_id_id", "category_id", "subcategory_id", "id"),
+        db.Index("ix_product_listing_subcategory_id", "subcategory_id"),
+    )
+
+
 class Category(db.Model):
     __tablename__ = "categories"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True, nullable=False)
-    name = db.Column(db.String(120), nullable=False)
+    name = db.Column(db.String(120), nullable=False, index=True)
     product = db.relationship("Product", backref="category")
     subcategory = db.relationship("Subcategory", backref="category")
     
@@ -95,7 +146,7 @@ class Category(db.Model):
 class Subcategory(db.Model):
     __tablename__ = "subcategories"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True, nullable=False)
-    name = db.Column(db.String(120), nullable=False)
+    name = db.Column(db.String(120), nullable=False, index=True)
     category_id = db.Column(db.Integer, db.ForeignKey("categories.id"), nullable=False)
     product =db.relationship("Product", backref="subcategory")
     def serialize(self):
@@ -107,17 +158,32 @@ class Subcategory(db.Model):
         }
 
 
+# append-only stock ledger: every movement is a new signed row, Product.amount caches their sum (see api/inventory.py)
 class Stock(db.Model):
     __tablename__ = "stock"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True, nullable=False)
-    products_id = db.Column(db.Integer, db.ForeignKey("products.id"), nullable=False)
+    # not a foreign key: a deleted product keeps its ledger, closed with a last "closing" row
+    products_id = db.Column(db.Integer, nullable=False)
+    # positive when stock comes in, negative when it is sold
     quantity = db.Column(db.Integer, nullable=False)
     date_in = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    # "initial", "restock", "adjustment", "order" or "closing"
+    reason = db.Column(db.String(20), default="restock", server_default="restock", nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"))
+    __table_args__ = (
+        # ledger of a product, and the movements of an order
+        db.Index("ix_stock_products_id_id", "products_id", "id"),
+        db.Index("ix_stock_order_id", "order_id"),
+    )
      
     def serialize(self):
         return {
-            
-            # do not serialize the password, its a security breach
+            "id": self.id,
+            "product_id": self.products_id,
+            "quantity": self.quantity,
+            "reason": self.reason,
+            "order_id": self.order_id,
+            "date": self.date_in,
         }
         
        
@@ -178,8 +244,14 @@ class RecoverPassword(db.Model):
         
 class OTP(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(120), nullable=False)
+    # one active code per email, see api.otp
+    email = db.Column(db.String(120), nullable=False, unique=True, index=True)
     otp = db.Column(db.String(6), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    expires_at = db.Column(db.DateTime, nullable=False)
-    
\ No newline at end of file
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+# single row counter bumped on every catalog write, every worker compares it to invalidate its caches
+class CatalogVersion(db.Model):
+    __tablename__ = "catalog_version"
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
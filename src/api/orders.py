@@ -0,0 +1,106 @@
+"""
+Order creation and order history.
+
+place_order() writes an order and all of its details in one transaction,
+takes its items out of stock in the same one (see api/inventory.py) and
+deduplicates client retries by Idempotency-Key.
+
+A page of order history is loaded with one query, and all of its details,
+with the product name and photo, with a second one, no matter how many
+orders or items the user has.
+"""
+from collections import defaultdict
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from api import inventory
+from api.models import db, Order, OrderDetail, Product
+from api.pagination import paginate
+
+
+def order_history(user_id):
+    """Returns (orders, next_cursor) for the page asked for in the request."""
+    orders, next_cursor = paginate(
+        db.session.query(Order.id, Order.price, Order.date).filter(Order.user_id == user_id),
+        Order.id,
+    )
+    if not orders:
+        return [], next_cursor
+
+    details = (
+        db.session.query(
+            OrderDetail.order_id,
+            OrderDetail.product_id,
+            OrderDetail.quantity,
+            OrderDetail.price,
+            func.coalesce(Product.name, OrderDetail.name).label("name"),
+            Product.photo,
+        )
+        .outerjoin(Product, OrderDetail.product_id == Product.id)
+        .filter(OrderDetail.order_id.in_([order.id for order in orders]))
+        .order_by(OrderDetail.order_id, OrderDetail.id)
+    )
+
+    items_by_order = defaultdict(list)
+    for detail in details:
+        items_by_order[detail.order_id].append({
+            "product_id": detail.product_id,
+            "quantity": detail.quantity,
+            "price": detail.price,
+            "name": detail.name,
+            "photo": detail.photo,
+        })
+
+    result = [{
+        "id": order.id,
+        "total": order.price,
+        "items": items_by_order[order.id],
+        "date": order.date,
+    } for order in orders]
+    return result, next_cursor
+
+
+def find_order_id(user_id, idempotency_key):
+    return (
+        db.session.query(Order.id)
+        .filter(Order.user_id == user_id, Order.idempotency_key == idempotency_key)
+        .scalar()
+    )
+
+
+def place_order(order, items, idempotency_key=None):
+    """
+    Inserts `order` and a bulk insert of its `items` in a single commit,
+    after reserving their stock; a 409 APIException is raised, with nothing
+    written, when an item is short. Returns (order_id, created). When an order with the same
+    idempotency key already exists for the user, nothing is written and
+    that order's id is returned with created=False.
+    """
+    if idempotency_key:
+        existing = find_order_id(order.user_id, idempotency_key)
+        if existing is not None:
+            return existing, False
+        order.idempotency_key = idempotency_key
+
+    try:
+        db.session.add(order)
+        db.session.flush()
+        inventory.reserve(order.id, items)
+        db.session.execute(OrderDetail.__table__.insert(), [{
+            "order_id": order.id,
+            "product_id": item["product_id"],
+            "quantity": item["quantity"],
+            "price": item["price"],
+            "name": item["name"],
+        } for item in items])
+        order_id = order.id
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent retry with the same key won the unique constraint
+        db.session.rollback()
+        existing = find_order_id(order.user_id, idempotency_key) if idempotency_key else None
+        if existing is None:
+            raise
+        return existing, False
+    # product_listing already has the new amounts; cached listings show them within
+    # CATALOG_STOCK_TTL seconds (see api/cache.py), no catalog version bump
+    return order_id, True
@@ -0,0 +1,144 @@
+"""
+One-time password store for password recovery.
+
+Each email has at most one code: saving a new one replaces the old one
+with a single upsert on the unique email index. Lookups only match codes
+that have not expired, and a code is consumed with one DELETE, so it can
+not be used twice. Expired codes are removed in batches by sweep(), from
+`flask sweep-otps` or from a thread started when OTP_SWEEP_INTERVAL is set.
+
+Failed verifications are counted per email in memory; after
+OTP_MAX_ATTEMPTS failures within the TTL further attempts are refused
+without touching the database until the window passes or a new code is
+saved. The counters are per process, so with several gunicorn workers the
+effective limit is that many times higher.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy.dialects import postgresql, sqlite
+from api.models import db, OTP
+
+TTL = timedelta(minutes=int(os.getenv("OTP_TTL_MINUTES", 10)))
+MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", 5))
+SWEEP_INTERVAL = int(os.getenv("OTP_SWEEP_INTERVAL", 0))
+SWEEP_BATCH_SIZE = 1000
+# emails with failed attempts tracked before stale entries are dropped
+MAX_TRACKED_EMAILS = 10000
+
+
+class AttemptLimiter:
+
+    def __init__(self, max_attempts, window):
+        self.max_attempts = max_attempts
+        self.window = window
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def blocked(self, key):
+        entry = self._failures.get(key)
+        return entry is not None and entry[0] >= self.max_attempts and time.monotonic() - entry[1] < self.window
+
+    def failed(self, key):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._failures) >= MAX_TRACKED_EMAILS:
+                self._failures = {k: v for k, v in self._failures.items() if now - v[1] < self.window}
+            count, started = self._failures.get(key, (0, now))
+            if now - started >= self.window:
+                count, started = 0, now
+            self._failures[key] = (count + 1, started)
+
+    def reset(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+
+
+class OTPStore:
+
+    def __init__(self, ttl=TTL, max_attempts=MAX_ATTEMPTS):
+        self.ttl = ttl
+        self.attempts = AttemptLimiter(max_attempts, ttl.total_seconds())
+        self._sweeper = None
+        self._lock = threading.Lock()
+
+    def save(self, email, code):
+        """Stores `code` as the only active code of `email` (the caller commits)."""
+        now = datetime.utcnow()
+        values = {"email": email, "otp": code, "created_at": now, "expires_at": now + self.ttl}
+        dialect = db.engine.dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            insert = (postgresql if dialect == "postgresql" else sqlite).insert(OTP.__table__).values(**values)
+            db.session.execute(insert.on_conflict_do_update(
+                index_elements=[OTP.email],
+                set_={"otp": insert.excluded.otp, "created_at": insert.excluded.created_at,
+                      "expires_at": insert.excluded.expires_at},
+            ))
+        else:
+            OTP.query.filter_by(email=email).delete(synchronize_session=False)
+            db.session.execute(OTP.__table__.insert().values(**values))
+        self.attempts.reset(email)
+
+    def blocked(self, email):
+        return self.attempts.blocked(email)
+
+    def consume(self, email, code):
+        """Deletes the code if it matches and has not expired; returns whether it did (the caller commits)."""
+        deleted = (
+            OTP.query
+            .filter(OTP.email == email, OTP.otp == code, OTP.expires_at > datetime.utcnow())
+            .delete(synchronize_session=False)
+        )
+        if deleted:
+            self.attempts.reset(email)
+        else:
+            self.attempts.failed(email)
+        return bool(deleted)
+
+    def sweep(self, batch_size=SWEEP_BATCH_SIZE):
+        """Deletes expired codes, `batch_size` rows per transaction; returns how many."""
+        total = 0
+        while True:
+            expired = (
+                db.session.query(OTP.id)
+                .filter(OTP.expires_at <= datetime.utcnow())
+                .limit(batch_size)
+                .scalar_subquery()
+            )
+            deleted = OTP.query.filter(OTP.id.in_(expired)).delete(synchronize_session=False)
+            db.session.commit()
+            total += deleted
+            if deleted < batch_size:
+                return total
+
+    def keep_latest(self):
+        """Deletes all but the newest code of every email, needed once before the unique index is created."""
+        latest = db.session.query(db.func.max(OTP.id)).group_by(OTP.email).scalar_subquery()
+        deleted = OTP.query.filter(OTP.id.notin_(latest)).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+    def start_sweeper(self, app, interval=SWEEP_INTERVAL):
+        """Starts the background sweeper thread of this process once, when `interval` is set."""
+        if interval <= 0 or self._sweeper is not None:
+            return
+        with self._lock:
+            if self._sweeper is not None:
+                return
+
+            def run():
+                while True:
+                    time.sleep(interval)
+                    with app.app_context():
+                        try:
+                            self.sweep()
+                        except Exception:
+                            db.session.rollback()
+                            app.logger.exception("OTP sweep failed")
+
+            self._sweeper = threading.Thread(target=run, name="otp-sweeper", daemon=True)
+            self._sweeper.start()
+
+
+otp_store = OTPStore()
@@ -0,0 +1,98 @@
+"""
+Opt-in keyset (cursor) pagination for the list endpoints.
+
+Without a `limit` query param the endpoints keep returning the full JSON
+array. With `?limit=N` they return {"items": [...], "next_cursor": "..."}
+and the client passes `?after=<next_cursor>` to get the following page.
+Pages are selected with WHERE key > last_key ORDER BY key LIMIT N, never
+OFFSET, so a deep page costs the same as the first one.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from flask import request
+from sqlalchemy import and_, or_
+from api.utils import APIException
+
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(",", ":")).encode("utf-8")
+    return urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def cursor_types(key):
+    """JSON types a cursor value may have to be compared with `key`."""
+    python_type = key.type.python_type
+    if python_type is float:
+        return (int, float)
+    if python_type is int:
+        return (int,)
+    return (python_type,)
+
+
+def decode_cursor(cursor, keys):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(urlsafe_b64decode(padded.encode("ascii")))
+    except ValueError:
+        raise APIException("Invalid cursor", status_code=400)
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise APIException("Invalid cursor", status_code=400)
+    for key, value in zip(keys, values):
+        # bool is an int too, but never a key
+        if isinstance(value, bool) or not isinstance(value, cursor_types(key)):
+            raise APIException("Invalid cursor", status_code=400)
+    return values
+
+
+def is_paginated():
+    return "limit" in request.args
+
+
+def page_limit():
+    try:
+        limit = int(request.args["limit"])
+    except ValueError:
+        raise APIException("limit must be an integer", status_code=400)
+    if limit < 1:
+        raise APIException("limit must be positive", status_code=400)
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def after_key(keys, values):
+    # (k1, k2, ...) > (v1, v2, ...) spelled out so it works on every backend
+    clauses = []
+    for i, key in enumerate(keys):
+        equal = [keys[j] == values[j] for j in range(i)]
+        clauses.append(and_(*equal, key > values[i]))
+    return or_(*clauses)
+
+
+def paginate(query, *keys):
+    """
+    Orders `query` by `keys` (ascending, unique together) and applies the
+    page requested in the query string. Returns (rows, next_cursor);
+    `rows` is the whole result when the client did not ask for a page.
+    """
+    query = query.order_by(*keys)
+    if not is_paginated():
+        return query.all(), None
+
+    limit = page_limit()
+    cursor = request.args.get("after")
+    if cursor:
+        query = query.filter(after_key(keys, decode_cursor(cursor, keys)))
+
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, key.key) for key in keys)
+
+
+def page_response(items, next_cursor):
+    if not is_paginated():
+        return items
+    return {"items": items, "next_cursor": next_cursor}
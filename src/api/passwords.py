@@ -0,0 +1,105 @@
+"""
+Password hashing off the request threads.
+
+Hashing is made to be slow, so it runs in a small process pool instead
+of the gunicorn worker that serves catalog reads. The pool is bounded:
+when PASSWORD_HASH_QUEUE hashes are already waiting or running, new ones
+are refused with a 429 instead of queueing without limit.
+
+    PASSWORD_HASH_METHOD   werkzeug method with its cost, e.g.
+                           "scrypt:32768:8:1" (default) or "pbkdf2:sha256:600000"
+    PASSWORD_HASH_WORKERS  processes in the pool (default 2, 0 hashes inline)
+    PASSWORD_HASH_QUEUE    hashes waiting or running at once (default 4 per worker)
+
+Hashes made with another method or cost are replaced on the next
+successful login (see check_and_upgrade).
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+from api.utils import APIException
+
+METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+
+
+def needs_rehash(pwhash, method=METHOD):
+    return pwhash.split("$", 1)[0] != method
+
+
+# these run in the pool processes
+
+def _hash(secret, method):
+    return generate_password_hash(secret, method=method)
+
+
+def _check(pwhash, secret, method):
+    """Returns (matches, new hash when `method` is given and the stored hash uses another method or cost)."""
+    if not check_password_hash(pwhash, secret):
+        return False, None
+    if method is None or not needs_rehash(pwhash, method):
+        return True, None
+    return True, generate_password_hash(secret, method=method)
+
+
+class PasswordHasher:
+
+    def __init__(self, method=METHOD, workers=2, queue_size=8):
+        self.method = method
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @classmethod
+    def from_env(cls):
+        workers = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+        return cls(METHOD, workers, int(os.getenv("PASSWORD_HASH_QUEUE", max(workers, 1) * 4)))
+
+    def executor(self):
+        # created on first use so every gunicorn worker gets its own pool; spawn, because
+        # forking a process that already runs threads is not safe
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise APIException("Demasiadas solicitudes, intente más tarde", status_code=429)
+        try:
+            if self.workers == 0:
+                return fn(*args)
+            try:
+                return self.executor().submit(fn, *args).result()
+            except BrokenProcessPool:
+                # a pool process died (e.g. killed for memory); start a new pool once
+                self.shutdown()
+                return self.executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password, salt):
+        return self.run(_hash, f"{password}{salt}", self.method)
+
+    def check(self, pwhash, password, salt):
+        matches, _ = self.run(_check, pwhash, f"{password}{salt}", None)
+        return matches
+
+    def check_and_upgrade(self, user, password):
+        """Checks the password of a User; on success a legacy hash is replaced (the caller commits)."""
+        matches, new_hash = self.run(_check, user.password, f"{password}{user.salt}", self.method)
+        if new_hash is not None:
+            user.password = new_hash
+        return matches
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+password_hasher = PasswordHasher.from_env()
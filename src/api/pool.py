@@ -0,0 +1,43 @@
+"""
+Database connection pool settings and stats.
+
+The pool is sized from the environment so it can be fitted to the
+connection limit of the database plan (workers x (size + overflow) must
+stay below it):
+    DB_POOL_SIZE       connections kept open per process (default 5)
+    DB_MAX_OVERFLOW    extra connections allowed under load (default 2)
+    DB_POOL_TIMEOUT    seconds to wait for a free connection (default 10)
+    DB_POOL_RECYCLE    seconds before a connection is replaced (default 1800)
+    DB_POOL_PRE_PING   check connections before use, 1 or 0 (default 1)
+SQLite keeps SQLAlchemy's own pool, these settings do not apply to it.
+"""
+import os
+
+
+def engine_options(database_url):
+    if database_url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 2)),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 10)),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") == "1",
+    }
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    if not hasattr(pool, "checkedout"):
+        return stats
+    capacity = pool.size() + max(getattr(pool, "_max_overflow", 0), 0)
+    stats.update({
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "capacity": capacity,
+        "saturation": round(pool.checkedout() / capacity, 2) if capacity else None,
+    })
+    return stats
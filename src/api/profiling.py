@@ -0,0 +1,191 @@
+"""
+On-demand profiling of single requests.
+
+An admin adds the header `X-Profile: 1` (or `?_profile=1`) to a request;
+that request alone runs under cProfile and every SQL statement it sends
+is recorded with its duration. Two files are written to PROFILE_DIR:
+<id>.prof (pstats, opens in snakeviz, or flameprof for a flamegraph) and
+<id>.json (a summary with the slowest functions and the SQL). The id is
+returned in the X-Profile-Id response header and the files can be fetched
+later from /api/profiles/<id>.
+
+Requests without the flag only pay for one header lookup here and one
+thread-local check per SQL statement.
+"""
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+from flask import g, request, jsonify, send_file
+from flask_jwt_extended import get_jwt_identity, jwt_required, verify_jwt_in_request
+from sqlalchemy import event
+from api.models import db, User
+from api.utils import APIException
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 100))
+TOP_FUNCTIONS = 40
+
+# statements of the request being profiled in this thread
+_capture = threading.local()
+# only one cProfile profiler can be active at a time
+_profiler_lock = threading.Lock()
+
+
+def wants_profile():
+    return request.headers.get("X-Profile") == "1" or request.args.get("_profile") == "1"
+
+
+def require_admin():
+    user = db.session.get(User, int(get_jwt_identity()))
+    if user is None or not user.admin:
+        raise APIException("Solo un administrador puede perfilar solicitudes", status_code=403)
+
+
+def before_request():
+    if not wants_profile():
+        return
+    verify_jwt_in_request()
+    require_admin()
+    if not _profiler_lock.acquire(blocking=False):
+        # another profiled request is running; serve this one normally
+        g.profile_busy = True
+        return
+    g.profile_id = uuid.uuid4().hex
+    g.profile_start = time.perf_counter()
+    _capture.statements = []
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+
+def after_request(response):
+    if "profile_id" in g:
+        g.profile_status = response.status_code
+        response.headers["X-Profile-Id"] = g.profile_id
+    elif g.get("profile_busy"):
+        response.headers["X-Profile"] = "busy"
+    return response
+
+
+def teardown_request(error):
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return
+    try:
+        profiler.disable()
+        took = time.perf_counter() - g.profile_start
+        statements = _capture.statements
+        save(g.profile_id, profiler, took, statements, g.get("profile_status", 500))
+    finally:
+        _capture.statements = None
+        _profiler_lock.release()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_capture, "statements", None) is not None:
+        conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    statements = getattr(_capture, "statements", None)
+    if statements is not None and conn.info.get("profile_start"):
+        took = time.perf_counter() - conn.info["profile_start"].pop()
+        statements.append({"sql": statement, "executemany": executemany, "ms": round(took * 1000, 3)})
+
+
+def function_summary(profiler):
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, name), (_, calls, own, cumulative, _) in stats.stats.items():
+        rows.append({
+            "function": f"{filename}:{line}({name})",
+            "calls": calls,
+            "own_ms": round(own * 1000, 3),
+            "cumulative_ms": round(cumulative * 1000, 3),
+        })
+    rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+    return rows[:TOP_FUNCTIONS]
+
+
+def save(profile_id, profiler, took, statements, status):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(os.path.join(PROFILE_DIR, f"{profile_id}.prof"))
+    summary = {
+        "id": profile_id,
+        "method": request.method,
+        "path": request.full_path.rstrip("?"),
+        "status": status,
+        "created": time.time(),
+        "duration_ms": round(took * 1000, 3),
+        "sql": {
+            "count": len(statements),
+            "total_ms": round(sum(statement["ms"] for statement in statements), 3),
+            "statements": statements,
+        },
+        "functions": function_summary(profiler),
+    }
+    with open(os.path.join(PROFILE_DIR, f"{profile_id}.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    prune()
+
+
+def prune():
+    summaries = sorted(
+        (entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(".json")),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in summaries[:-PROFILE_KEEP]:
+        for extension in (".json", ".prof"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, entry.name[:-5] + extension))
+            except FileNotFoundError:
+                pass
+
+
+def profile_path(profile_id, extension):
+    if not profile_id.isalnum():
+        raise APIException("Perfil no encontrado", status_code=404)
+    path = os.path.join(PROFILE_DIR, f"{profile_id}{extension}")
+    if not os.path.isfile(path):
+        raise APIException("Perfil no encontrado", status_code=404)
+    return path
+
+
+@jwt_required()
+def list_profiles():
+    require_admin()
+    profiles = []
+    if os.path.isdir(PROFILE_DIR):
+        for entry in os.scandir(PROFILE_DIR):
+            if entry.name.endswith(".json"):
+                with open(entry.path) as f:
+                    summary = json.load(f)
+                profile = {key: summary[key] for key in ("id", "method", "path", "status", "created", "duration_ms")}
+                profile["sql_count"] = summary["sql"]["count"]
+                profiles.append(profile)
+    profiles.sort(key=lambda profile: profile["created"], reverse=True)
+    return jsonify(profiles), 200
+
+
+@jwt_required()
+def get_profile(profile_id):
+    require_admin()
+    if request.args.get("format") == "prof":
+        return send_file(profile_path(profile_id, ".prof"), mimetype="application/octet-stream",
+                         as_attachment=True, download_name=f"{profile_id}.prof")
+    return send_file(profile_path(profile_id, ".json"), mimetype="application/json")
+
+
+def setup_profiling(app):
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, "before_cursor_execute", before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    app.add_url_rule("/api/profiles", "list_profiles", list_profiles)
+    app.add_url_rule("/api/profiles/<profile_id>", "get_profile", get_profile)
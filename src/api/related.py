@@ -0,0 +1,53 @@
+"""
+Related products sampling.
+
+Keeps the product ids of each category in memory so picking a sample is
+random.sample() over a tuple instead of ORDER BY random() over the whole
+category. Each pool is tagged with the catalog version it was read at
+and reloaded as soon as the caller passes a different one, so a product
+written through another worker shows up here with the same delay as in the
+cached listings. The writing worker also drops its pools right away
+(through catalog.products_changed).
+"""
+import random
+import threading
+from api.models import db, ProductListing
+
+
+class RelatedProducts:
+
+    def __init__(self):
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def pool(self, category_id, version):
+        entry = self._pools.get(category_id)
+        if entry is None or entry[0] != version:
+            ids = tuple(product_id for (product_id,) in db.session.query(ProductListing.id)
+                        .filter(ProductListing.category_id == category_id)
+                        .order_by(ProductListing.id))
+            entry = (version, ids)
+            with self._lock:
+                self._pools[category_id] = entry
+        return entry[1]
+
+    def sample(self, category_id, version, count=4, seed=None, exclude=None):
+        """
+        Returns up to `count` product ids of the category, from the pool of
+        catalog `version`. With a `seed` the same ids come back every time
+        (until the category changes), which keeps the response cacheable.
+        """
+        ids = self.pool(category_id, version)
+        rng = random.Random(seed) if seed is not None else random
+        picked = rng.sample(ids, min(len(ids), count + 1))
+        return [product_id for product_id in picked if product_id != exclude][:count]
+
+    def invalidate(self, *category_ids):
+        with self._lock:
+            if not category_ids:
+                self._pools.clear()
+            for category_id in category_ids:
+                self._pools.pop(category_id, None)
+
+
+related_products = RelatedProducts()
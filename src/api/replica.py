@@ -0,0 +1,131 @@
+"""
+Optional read replica.
+
+Set DATABASE_REPLICA_URL and the read-only routes marked with
+@read_replica (catalog listings, search, categories, order history) run
+their queries on the replica; everything else, and every flush, stays on
+the primary. After a successful write, the same client's reads go to the
+primary for REPLICA_STICKY_SECONDS (default 5), so users see their own
+changes even while the replica lags behind. The window is kept twice: in
+a short-lived cookie, for browsers, and in users.read_primary_until for
+the JWT identity of the write, for clients that send the Authorization
+header but keep no cookies (reading it is one primary lookup by id).
+
+For local work two SQLite files can play primary and replica:
+    $ DATABASE_URL=sqlite:////tmp/primary.db DATABASE_REPLICA_URL=sqlite:////tmp/replica.db \\
+      flask replica-sync --interval 2
+copies the primary into the replica every 2 seconds.
+"""
+import logging
+import os
+import sqlite3
+import time
+from functools import wraps
+from flask import current_app, g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from flask_sqlalchemy.session import Session
+from jwt.exceptions import PyJWTError
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+REPLICA = "replica"
+STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", 5))
+STICKY_COOKIE = "read_primary_until"
+
+
+def replica_url():
+    url = os.getenv("DATABASE_REPLICA_URL")
+    return url.replace("postgres://", "postgresql://") if url else None
+
+
+def reading_from():
+    """"replica" inside a @read_replica view, "primary" anywhere else."""
+    return REPLICA if has_request_context() and g.get("read_replica", False) else "primary"
+
+
+class RoutingSession(Session):
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and reading_from() == REPLICA:
+            engine = self._db.engines.get(REPLICA)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def request_user_id():
+    """The JWT identity of the request, or None without a (valid) token."""
+    try:
+        verify_jwt_in_request(optional=True)
+        return get_jwt_identity()
+    except (JWTExtendedException, PyJWTError):
+        return None
+
+
+def wrote_recently():
+    try:
+        if float(request.cookies.get(STICKY_COOKIE, 0)) > time.time():
+            return True
+    except ValueError:
+        pass
+    user_id = request_user_id()
+    if user_id is None:
+        return False
+    # api.models imports this module
+    from api.models import db, User
+    until = db.session.query(User.read_primary_until).filter(User.id == user_id).scalar()
+    return until is not None and until > time.time()
+
+
+def read_replica(view):
+    """Runs the queries of a read-only view on the replica, unless this client just wrote."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_replica = REPLICA in current_app.config.get("SQLALCHEMY_BINDS", {}) and not wrote_recently()
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def remember_write(response):
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        until = time.time() + STICKY_SECONDS
+        response.set_cookie(STICKY_COOKIE, str(until), max_age=STICKY_SECONDS, httponly=True, samesite="Lax")
+        user_id = request_user_id()
+        if user_id is not None:
+            remember_user_write(user_id, until)
+    return response
+
+
+def remember_user_write(user_id, until):
+    from api.models import db, User
+    try:
+        db.session.query(User).filter(User.id == user_id).update(
+            {User.read_primary_until: until}, synchronize_session=False)
+        db.session.commit()
+    except SQLAlchemyError:
+        # the write itself is already committed, at worst the next read is stale
+        db.session.rollback()
+        logger.warning("could not keep the primary reads of user %s", user_id, exc_info=True)
+
+
+def setup_replica(app, engine_options):
+    url = replica_url()
+    if url is None:
+        return
+    app.config.setdefault("SQLALCHEMY_BINDS", {})[REPLICA] = {"url": url, **engine_options(url)}
+    app.after_request(remember_write)
+
+
+def sync_sqlite(primary_path, replica_path):
+    """Copies a SQLite primary into its replica file (local replica setup only)."""
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(replica_path)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
@@ -1,96 +1,122 @@
 """
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
-from flask import Flask, request, jsonify, url_for, Blueprint
-from api.models import db, User, Product, Category, Subcategory, RecoverPassword, OTP, Order, OrderDetail
-from api.utils import generate_sitemap, APIException
+from flask import request, jsonify, Blueprint, current_app
+from api.models import db, User, Product, ProductListing, Category, Subcategory, Order
+from api.utils import APIException
+from api import catalog, inventory, listing, search, uploads, passwords
+from api.pagination import paginate, page_response, is_paginated
+from api.orders import order_history, place_order
+from api.pool import pool_stats
+from api.otp import otp_store
+from api.replica import read_replica
+from api.related import related_products
+from api.uploads import upload_pipeline
+from api.cache import cached_catalog_response, catalog_cache
+from api.streaming import stream_json_array, wants_stream
+from api.serializers import (CATEGORY_COLUMNS, SUBCATEGORY_COLUMNS, USER_COLUMNS, encode_products,
+                             encode_row, encode_rows, json_response, page_body, rows_query)
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
+import logging
 import os, datetime
 from datetime import datetime, timedelta
 from base64 import b64encode
 from flask_jwt_extended import create_access_token, get_jwt_identity, jwt_required
-import cloudinary.uploader
-from random import sample
-import cloudinary
-from sqlalchemy import create_engine
-
+from sqlalchemy import text
+import time
 
+logger = logging.getLogger(__name__)
 
 api = Blueprint('api', __name__)
 
 # Allow CORS requests to this API
 CORS(api)
 
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET")
-)
-
-
-print("Cloudinary Config:")
-print("CLOUD_NAME:", os.getenv("CLOUDINARY_CLOUD_NAME"))
-print("API_KEY:", os.getenv("CLOUDINARY_API_KEY"))
-print("API_SECRET:", os.getenv("CLOUDINARY_API_SECRET"))
-
 test_db = Blueprint('test_db', __name__)
 
 @test_db.route('/test-db')
 def test_database():
+    # reuses the app's pool, a health check must not open connections of its own
+    start = time.perf_counter()
     try:
-        DATABASE_URL = os.getenv("DATABASE_URL")  # Leer la URL de la BD
-        engine = create_engine(DATABASE_URL)
-        connection = engine.connect()
-        connection.close()
-        return "✅ Conexión exitosa a la base de datos", 200
+        with db.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
     except Exception as e:
-        return f"🚨 Error conectando a la base de datos: {e}", 500
+        return jsonify({"message": f"🚨 Error conectando a la base de datos: {e}", "pool": pool_stats(db.engine)}), 503
+    latency = (time.perf_counter() - start) * 1000
+    stats = pool_stats(db.engine)
+    saturated = (stats.get("saturation") or 0) >= 0.9
+    return jsonify({
+        "message": "✅ Conexión exitosa a la base de datos",
+        "status": "saturated" if saturated else "ok",
+        "latency_ms": round(latency, 2),
+        "pool": stats,
+    }), 200
     
 @api.route('/products', methods=['GET'])
+@read_replica
+@cached_catalog_response()
 def get_products():
-    products = Product.query.all()
-    products_serialized = [product.serialize() for product in products]
-    return jsonify(products_serialized), 200
+    if wants_stream():
+        return catalog.stream_products()
+    body, _ = catalog.products_page()
+    return json_response(body), 200
 
 @api.route('/products/<int:id>', methods=['GET'])
+@read_replica
+@cached_catalog_response()
 def get_products_by_id(id):
-    product = Product.query.get(id)
+    product = catalog.product_json(id)
     if not product: 
         return jsonify({"message" : "Producto no encontrado"}), 404
-    return jsonify(product.serialize()), 200
+    return json_response(product), 200
 
 # ruta solo filtrado de producto por categoria   
 @api.route('/products/categories/<int:category_id>', methods=['GET'])
+@read_replica
+@cached_catalog_response()
 def get_products_by_category(category_id):
-    products = Product.query.filter_by(category_id=category_id).all()
-    if not products: 
+    if wants_stream():
+        # same 404 as the paginated path, checked before the stream starts with a 200
+        if not catalog.has_products(category_id=category_id):
+            return jsonify({"message" : "Producto no encontrado"}), 404
+        return catalog.stream_products(category_id=category_id)
+    body, count = catalog.products_page(category_id=category_id)
+    if not count: 
         return jsonify({"message" : "Producto no encontrado"}), 404
-    return jsonify([product.serialize() for product in products]), 200  
+    return json_response(body), 200  
    
    
 # ruta para filtro de productos por categoria y subcategoria   
 @api.route('/products/categories/<int:category_id>/subcategories/<int:subcategory_id>', methods=['GET'])
+@read_replica
+@cached_catalog_response()
 def get_products_by_category_and_subcategory(category_id, subcategory_id):
-    products = Product.query.filter_by(category_id=category_id, subcategory_id=subcategory_id).all()
-    return jsonify([product.serialize() for product in products]), 200  
+    if wants_stream():
+        return catalog.stream_products(category_id=category_id, subcategory_id=subcategory_id)
+    body, _ = catalog.products_page(category_id=category_id, subcategory_id=subcategory_id)
+    return json_response(body), 200  
    
 
 @api.route('/products/related/<int:category_id>', methods=['GET'])
+@read_replica
+@cached_catalog_response(when=lambda: "product_id" in request.args)
 def get_randomProduct_by_category(category_id):
     
-    products = Product.query.filter(Product.category_id == category_id).order_by(db.func.random()).limit(4).all()
-    products_ids = (prod.id for prod in products)
-    ramdom_products = Product.query.filter(Product.id.in_(products_ids)).all()
+    # ?product_id= seeds the sample with the product being viewed (and leaves it out)
+    # so the same page always gets the same related products
+    product_id = request.args.get("product_id", type=int)
+    products_ids = related_products.sample(category_id, catalog.current_version(), 4,
+                                           seed=product_id, exclude=product_id)
+    ramdom_products = catalog.products_by_ids_json(products_ids)
 
-    return jsonify([product.serialize() for product in ramdom_products]), 200 
+    return json_response(ramdom_products), 200 
 
 
        
 @api.route('/products', methods=['POST'])
 def add_products():
     body = request.form
-    print(body)
  
  
 
@@ -107,29 +133,63 @@ def add_products():
         return jsonify({"error": "subcategory_id required"})
     if 'price' not in body:
         return jsonify({"error": "price required"})
+    amount = inventory.parse_amount(body['amount'])
     subcategory_exist = Subcategory.query.filter_by(name=body['name']).first()     
     if subcategory_exist:
         return jsonify({"error" : "subcategory name already exist"}), 400 
     
     file = request.files["photo"]
-    resp = cloudinary.uploader.upload(file, folder="mygallery")
-    if not resp: 
-        return jsonify({"error": "error uploading photo"}), 400
+    data = file.read()
     
     
-    new_product = Product(
-        name=body['name'],
-        photo= resp["secure_url"], 
-        public_id= resp["public_id"],
-        amount=body['amount'],
-        category_id=body['category_id'],
-        subcategory_id=body['subcategory_id'],
-        price=body['price']
-                  
-        )
-    db.session.add(new_product)
-    db.session.commit()
-    return jsonify({"message": "Product added" }), 200
+    # the photo is uploaded in the background, see api/uploads.py; a full
+    # queue refuses the product before it is saved
+    upload_pipeline.reserve()
+    try:
+        new_product = Product(
+            name=body['name'],
+            photo= "", 
+            public_id= "",
+            amount=amount,
+            category_id=body['category_id'],
+            subcategory_id=body['subcategory_id'],
+            price=body['price']
+                      
+            )
+        upload_pipeline.mark_pending(new_product)
+        db.session.add(new_product)
+        db.session.flush()
+        inventory.open_stock(new_product.id, amount)
+        listing.sync_products(new_product.id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        upload_pipeline.release()
+        raise
+    product_id = new_product.id
+    upload_pipeline.submit(current_app._get_current_object(), new_product, data, file.filename)
+    catalog.products_changed(product_id, body['category_id'])
+    return jsonify({"message": "Product added", "id": product_id, "image_status": uploads.PENDING }), 200
+
+
+@api.route('/products/<int:id>/image', methods=['GET'])
+def get_product_image_status(id):
+    status = db.session.query(Product.image_status).filter(Product.id == id).scalar()
+    if status is None:
+        return jsonify({"message" : "Producto no encontrado"}), 404
+    if status == uploads.PENDING:
+        # fails the upload if it has been pending for too long: the worker uploading it is gone
+        upload_pipeline.sweep(id)
+        upload_pipeline.start_sweeper(current_app._get_current_object())
+    product = db.session.query(Product.id, Product.photo, Product.image_status, Product.image_attempts,
+                               Product.image_error).filter(Product.id == id).first()
+    return jsonify({
+        "id": product.id,
+        "photo": product.photo,
+        "image_status": product.image_status,
+        "attempts": product.image_attempts,
+        "error": product.image_error,
+    }), 200
 
 @api.route('/products/<int:id>', methods=['DELETE'])
 def delete_product(id):
@@ -137,18 +197,28 @@ def delete_product(id):
         product = Product.query.get(id)
         if not product:
             return jsonify({"message" : "No existe producto"}),400
+        category_id = product.category_id
+        inventory.close_stock(id)
         db.session.delete(product)
+        listing.sync_products(id)
         db.session.commit()
+        catalog.products_changed(id, category_id)
         return jsonify({"message" : "Producto eliminado correctamente"}),200
     except Exception as e:
         db.session.rollback()
  
 
+@api.route('/catalog/cache-stats', methods=['GET'])
+def get_catalog_cache_stats():
+    return jsonify({"version": catalog.current_version(), **catalog_cache.stats()}), 200
+
+
 @api.route('/categories', methods=['GET'])
+@read_replica
+@cached_catalog_response()
 def get_categories():
-    categories = Category.query.all()
-    categories_serialized = [category.serialize() for category in categories]
-    return jsonify(categories_serialized), 200
+    categories = rows_query(CATEGORY_COLUMNS).order_by(Category.id)
+    return json_response(encode_rows(categories)), 200
     
     
 @api.route('/categories', methods=['POST'])
@@ -167,18 +237,39 @@ def add_category():
     )
     db.session.add(new_category)
     db.session.commit()
+    catalog.catalog_changed()
     return jsonify({"message": "Category Created", "category": new_category.serialize()})
 
+@api.route('/categories/<int:id>', methods=['PUT'])
+def rename_category(id):
+    body = request.get_json()
+
+    if 'name' not in body:
+        return jsonify({"error": "name required"}), 400
+    category = Category.query.get(id)
+    if not category:
+        return jsonify({"error": "Category not found"}), 404
+    category_exist = Category.query.filter(Category.name == body['name'], Category.id != id).first()
+    if category_exist:
+        return jsonify({"error" : "category name already exist"}), 400
+
+    category.name = body['name']
+    listing.rename_category(id, category.name)
+    db.session.commit()
+    catalog.catalog_changed()
+    return jsonify({"message": "Category updated", "category": category.serialize()}), 200
+
 @api.route('/categories/<int:id>', methods=['DELETE'])
 def delete_category():
     pass
 
 
 @api.route('/subcategories', methods=['GET'])
+@read_replica
+@cached_catalog_response()
 def get_subcategories():
-    subcategories = Subcategory.query.all()
-    subcategories_serialized = [subcategory.serialize() for subcategory in subcategories]
-    return jsonify(subcategories_serialized), 200
+    subcategories = rows_query(SUBCATEGORY_COLUMNS).order_by(Subcategory.id)
+    return json_response(encode_rows(subcategories)), 200
     
 @api.route('/subcategories', methods=['POST'])
 def add_subcategory():
@@ -199,8 +290,28 @@ def add_subcategory():
     )
     db.session.add(new_subcategory)
     db.session.commit()
+    catalog.catalog_changed()
     return jsonify({"message": "Subcategory Created", "subcategory": new_subcategory.serialize()})
 
+@api.route('/subcategories/<int:id>', methods=['PUT'])
+def rename_subcategory(id):
+    body = request.get_json()
+
+    if 'name' not in body:
+        return jsonify({"error": "name required"}), 400
+    subcategory = Subcategory.query.get(id)
+    if not subcategory:
+        return jsonify({"error": "Subcategory not found"}), 404
+    subcategory_exist = Subcategory.query.filter(Subcategory.name == body['name'], Subcategory.id != id).first()
+    if subcategory_exist:
+        return jsonify({"error" : "subcategory name already exist"}), 400
+
+    subcategory.name = body['name']
+    listing.rename_subcategory(id, subcategory.name)
+    db.session.commit()
+    catalog.catalog_changed()
+    return jsonify({"message": "Subcategory updated", "subcategory": subcategory.serialize()}), 200
+
 @api.route('/subcategories/<int:id>', methods=['DELETE'])
 def delete_subcategory():
     pass
@@ -222,7 +333,7 @@ def register():
         return jsonify({"message": "El usuario ya existe"}), 400
 
     salt = b64encode(os.urandom(32)).decode("utf-8")
-    hashed_password = generate_password_hash(f"{password}{salt}")
+    hashed_password = passwords.password_hasher.hash(password, salt)
 
     new_user = User(
         name=name,
@@ -286,9 +397,10 @@ def register():
     
 @api.route('/get_users', methods=["GET"])
 def get_users():
-    users = User.query.all()
-    users_serialized = [user.serialize() for user in users]
-    return jsonify(users_serialized), 200
+    if wants_stream():
+        return stream_json_array(rows_query(USER_COLUMNS).order_by(User.id), encode_row)
+    users, next_cursor = paginate(rows_query(USER_COLUMNS), User.id)
+    return json_response(page_body(encode_rows(users), next_cursor, is_paginated())), 200
 
 @api.route('/login', methods=["POST"])
 def login():
@@ -308,7 +420,9 @@ def login():
         if user is None:
             return jsonify({"message" : "Alguno de los datos no es correcto"}), 400
         else: 
-            if check_password_hash(user.password, f"{password}{user.salt}"):
+            if passwords.password_hasher.check_and_upgrade(user, password):
+                # saves the new hash when the stored one was made with an older method or cost
+                db.session.commit()
                 expire_at = timedelta(days=3)
                 token = create_access_token(identity=str(user.id), expires_delta=expire_at)
                 return jsonify({
@@ -325,6 +439,7 @@ def login():
 
 @api.route('/products/<int:id>', methods=['PUT'])
 def update_product(id):
+    reserved = False
     try:
         product = Product.query.get(id)
         if not product:
@@ -332,26 +447,46 @@ def update_product(id):
 
         body = request.form
         file = request.files.get("photo")
+        previous_category_id = product.category_id
+        amount = inventory.parse_amount(body['amount']) if 'amount' in body else None
+        if file:
+            data = file.read()
+            # a full upload queue refuses the edit before anything is saved
+            upload_pipeline.reserve()
+            reserved = True
 
         product.name = body.get('name', product.name)
         product.public_id = body.get('public_id', product.public_id)
         product.photo = body.get('photo', product.photo)
-        product.amount = body.get('amount', product.amount)
         product.price = body.get('price', product.price)
         product.category_id = body.get('category_id', product.category_id)
         product.subcategory_id = body.get('subcategory_id', product.subcategory_id)
+        if amount is not None:
+            # stock changes go through the ledger
+            inventory.set_available(id, amount)
 
         if file:
-            resp = cloudinary.uploader.upload(file, folder="mygallery")
-            product.photo = resp["secure_url"]
-            product.public_id = resp["public_id"]
+            # the current photo stays until the background upload replaces it
+            upload_pipeline.mark_pending(product)
             
+        listing.sync_products(id)
         db.session.commit()
+        if file:
+            reserved = False
+            upload_pipeline.submit(current_app._get_current_object(), product, data, file.filename)
+        catalog.products_changed(id, previous_category_id, product.category_id)
 
-        return jsonify({"message": "Producto modificado correctamente", "product": product.serialize()}), 200
+        return jsonify({"message": "Producto modificado correctamente", "product": catalog.get_product(product.id)}), 200
 
+    except APIException:
+        db.session.rollback()
+        if reserved:
+            upload_pipeline.release()
+        raise
     except Exception as e:
         db.session.rollback()
+        if reserved:
+            upload_pipeline.release()
         return jsonify({"error": str(e)}), 500
 
 @api.route('/profile', methods=["PUT"])
@@ -391,33 +526,39 @@ def change_password():
         if current_password is None or new_password is None:
             return jsonify({"message" : "Los campos contraseña actual y nueva contraseña son obligatorios"}), 400
        
-        if not check_password_hash(profile.password, f"{current_password}{profile.salt}"):
+        if not passwords.password_hasher.check(profile.password, current_password, profile.salt):
             return jsonify({"message" : "La constraseña actual no es correcta"}), 400
         
         salt = b64encode(os.urandom(32)).decode("utf-8")
-        new_password = generate_password_hash(f"{new_password}{salt}")
+        new_password = passwords.password_hasher.hash(new_password, salt)
      
         profile.password = new_password
         profile.salt = salt
         
         db.session.commit()
         return jsonify({"message" : "Contraseña actualizada correctamente"}), 200
+    except APIException:
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500     
   
 @api.route('/products/search', methods=["GET"])
+@read_replica
+@cached_catalog_response()
 def search_products():
     search_word = request.args.get("q")
     if not search_word:
-        products = Product.query.all()
-        products_serialized = [product.serialize() for product in products]
-        return jsonify(products_serialized), 200  
+        if wants_stream():
+            return catalog.stream_products()
+        body, _ = catalog.products_page()
+        return json_response(body), 200  
      
               
-    products = Product.query.filter(Product.name.ilike(f"%{search_word}%"))
-    products = [prod.serialize() for prod in products] 
-    return jsonify(products), 200
+    products, rank = search.apply_search(catalog.product_listing_query(), search_word)
+    products, next_cursor = paginate(products, rank, ProductListing.id)
+    products = encode_products(products) 
+    return json_response(page_body(products, next_cursor, is_paginated())), 200
 
 
 @api.route('/verify-otp', methods=["POST"])
@@ -430,38 +571,38 @@ def verify_otp():
     if not email or not otp or not new_password:
         return jsonify({"message": "Email, OTP y nueva contraseña son requeridos"}), 400
 
-    try:
-        otp_entry = OTP.query.filter_by(email=email, otp=otp).first()
-
-        if not otp_entry:
-            return jsonify({"message": "OTP inválido"}), 400
-
-        if datetime.utcnow() > otp_entry.expires_at:
-            return jsonify({"message": "El OTP ha expirado"}), 400
+    # too many wrong codes for this email: refused before touching the database
+    if otp_store.blocked(email):
+        return jsonify({"message": "Demasiados intentos, solicite un nuevo código"}), 429
 
+    try:
+        if not otp_store.consume(email, otp):
+            db.session.rollback()
+            return jsonify({"message": "OTP inválido o expirado"}), 400
 
         user = User.query.filter_by(email=email).first()
         if not user:
+            db.session.rollback()
             return jsonify({"message": "Usuario no encontrado"}), 404
 
 
         salt = b64encode(os.urandom(32)).decode("utf-8")
-        hashed_password = generate_password_hash(f"{new_password}{salt}")
+        hashed_password = passwords.password_hasher.hash(new_password, salt)
         user.password = hashed_password
         user.salt = salt
 
-        db.session.delete(otp_entry)
         db.session.commit()
 
         return jsonify({"message": "Contraseña actualizada correctamente"}), 200
 
+    except APIException:
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
     
 @api.route('/save_otp', methods=["POST"])
 def save_otp():
-    print("Recibiendo OTP")
     body = request.json
     email = body.get("email")
     otp = body.get("otp")
@@ -469,11 +610,9 @@ def save_otp():
     if not email or not otp:
         return jsonify({"message" : "Email y OTP son requeridos"}), 400
     
-    expiration_time = datetime.utcnow() + timedelta(minutes=10)
-    
+    otp_store.start_sweeper(current_app._get_current_object())
     try:
-        otp_entry = OTP(email=email, otp=otp, expires_at=expiration_time)
-        db.session.add(otp_entry)
+        otp_store.save(email, otp)
         db.session.commit()
         
         return jsonify({"message" : " OTP guardado"}), 200
@@ -509,65 +648,44 @@ def create_order():
     status = "OK"
     items = data.get('items')
     user_id=get_jwt_identity() 
+    idempotency_key = request.headers.get("Idempotency-Key")
     
     if not items:
         return jsonify({"message": "Faltan datos"}), 400
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= 120:
+        return jsonify({"message": "Idempotency-Key inválida"}), 400
     
     try:
         new_order = Order(user_id=user_id, date=date, price=price, address=address, deliver_address=deliver_address, status=status)
-        db.session.add(new_order)
-        db.session.commit()
+        order_id, created = place_order(new_order, items, idempotency_key)
         
-        for item in items:
-            new_detail = OrderDetail(
-                order_id= new_order.id,
-                product_id=item['product_id'],
-                quantity=item['quantity'],
-                price=item['price'],
-                name=item['name']
-                
-            )
-            db.session.add(new_detail)
-        db.session.commit()
-        
-        return jsonify({"message": "Orden Creada con éxito", "order_id": new_order.id})
+        response = jsonify({"message": "Orden Creada con éxito", "order_id": order_id})
+        if not created:
+            response.headers["Idempotent-Replayed"] = "true"
+        return response
+    except APIException:
+        # bad items, or not enough stock (409)
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
-        print(e)
+        logger.exception("could not create the order")
         return jsonify({"message": str(e)}), 500
 
 @api.route('/orders', methods=['GET'])
+@read_replica
 @jwt_required()
 def get_orders():
     try:
         
         user_id = get_jwt_identity()
-        orders = Order.query.filter_by(user_id=user_id).all()
-        if not orders:
+        result, next_cursor = order_history(user_id)
+        if not result:
             return jsonify({"message": "No se encontraron órdenes"}), 404
 
-        result = []
-        for order in orders:
-            order_details = OrderDetail.query.filter_by(order_id=order.id).all()
-            
-            details = [{
-                "product_id": detail.product_id,
-                "quantity": detail.quantity,
-                "price": detail.price,
-                "name": Product.query.get(detail.product_id).name, 
-                "photo": Product.query.get(detail.product_id).photo 
-                
-            } for detail in order_details]
-
-            result.append({
-                "id": order.id,
-                "total": order.price,
-                "items": details,
-                "date": order.date
-                
-            })
-
-        return jsonify(result), 200
+        return jsonify(page_response(result, next_cursor)), 200
 
+    except APIException:
+        raise
     except Exception as e:
         return jsonify({"message": str(e)}), 500
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""
+Full-text product search.
+
+Searches run on the product_listing table, like every other listing. On
+PostgreSQL they use a GIN index over to_tsvector('simple', name) plus a
+pg_trgm index for fuzzy matches; both are expression indexes, so
+PostgreSQL keeps them current on its own. On SQLite they use an FTS5 table
+(products_fts, rowid = products.id = product_listing.id) kept in sync by
+triggers on products, so add_products, update_product and delete_product
+need no extra work.
+Any other backend, or a SQLite database without products_fts, falls back
+to ILIKE.
+
+The indexes, the FTS5 table and its triggers are created by the
+0004_search_indexes migration (`flask db upgrade`); searches never
+create them. `flask search-index` refills products_fts from products,
+should it ever get out of step.
+"""
+import re
+from sqlalchemy import Float, cast, func, literal_column, or_, table, column, text
+from api.models import db, ProductListing
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+products_fts = table("products_fts", column("rowid"), column("name"))
+
+_fts_ready = {}
+
+
+def tokens(search_word):
+    return TOKEN_RE.findall(search_word.lower())
+
+
+def backend():
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        return "postgresql"
+    if dialect == "sqlite" and sqlite_fts_ready():
+        return "fts5"
+    return "like"
+
+
+def sqlite_fts_ready():
+    """Whether products_fts exists in the database this search reads from (primary or replica)."""
+    key = str(db.session.get_bind().url)
+    if not _fts_ready.get(key):
+        # only found indexes are remembered, so searches pick up `flask db upgrade` without a restart
+        _fts_ready[key] = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'products_fts'"
+        )).first() is not None
+    return _fts_ready[key]
+
+
+def rebuild_sqlite_index():
+    """Refills products_fts from products; returns False when there is nothing to refill."""
+    if db.engine.dialect.name != "sqlite" or not sqlite_fts_ready():
+        return False
+    db.session.execute(text("DELETE FROM products_fts"))
+    db.session.execute(text(
+        "INSERT INTO products_fts (rowid, name) SELECT id, name FROM products"
+    ))
+    db.session.commit()
+    return True
+
+
+def apply_search(query, search_word):
+    """
+    Restricts a product query to rows matching `search_word` and adds a
+    "rank" column. Returns (query, rank); lower rank means a better match,
+    so the results can be keyset paginated on (rank, ProductListing.id).
+    """
+    words = tokens(search_word)
+    engine = backend() if words else None
+    if not words:
+        rank = literal_column("0", Float).label("rank")
+        query = query.filter(False)
+    elif engine == "fts5":
+        match = " ".join(f'"{word}"*' for word in words)
+        rank = literal_column("bm25(products_fts)", Float).label("rank")
+        query = (
+            query.join(products_fts, products_fts.c.rowid == ProductListing.id)
+            .filter(text("products_fts MATCH :fts_query").bindparams(fts_query=match))
+        )
+    elif engine == "postgresql":
+        document = func.to_tsvector("simple", ProductListing.name)
+        ts_query = func.to_tsquery("simple", " & ".join(f"{word}:*" for word in words))
+        phrase = " ".join(words)
+        score = func.ts_rank(document, ts_query) + func.similarity(ProductListing.name, phrase)
+        rank = cast(-score, Float).label("rank")
+        query = query.filter(or_(document.op("@@")(ts_query), ProductListing.name.op("%")(phrase)))
+    else:
+        rank = literal_column("0", Float).label("rank")
+        for word in words:
+            query = query.filter(ProductListing.name.ilike(f"%{word}%"))
+
+    return query.add_columns(rank), rank
+
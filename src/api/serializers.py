@@ -0,0 +1,108 @@
+"""
+Fast JSON serialization for Product, Category, Subcategory and User.
+
+Rows come from column queries (plain tuples, no ORM identity map) and are
+encoded with orjson when it is installed, falling back to the standard
+library. Encoded products are kept per id as JSON fragments; a fragment is
+reused only while the row it was built from is unchanged, so an edited
+product is re-encoded on its next read in every worker, and
+forget_product() drops it right away in the worker that made the change.
+"""
+import json
+import os
+import threading
+from flask import current_app
+from api.models import db, Category, Subcategory, User
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+# same keys, same order as Product.serialize()
+PRODUCT_FIELDS = (
+    "id", "name", "photo", "amount", "category_id", "subcategory_id",
+    "price", "category", "subcategory",
+)
+CATEGORY_COLUMNS = (Category.id, Category.name)
+SUBCATEGORY_COLUMNS = (Subcategory.id, Subcategory.name, Subcategory.category_id)
+USER_COLUMNS = (User.id, User.name, User.lastname, User.email)
+
+FRAGMENT_CACHE_SIZE = int(os.getenv("PRODUCT_FRAGMENT_CACHE_SIZE", 100000))
+
+
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def row_to_dict(row):
+    return dict(zip(row._fields, row))
+
+
+def rows_query(columns):
+    return db.session.query(*columns)
+
+
+def product_to_dict(values):
+    return dict(zip(PRODUCT_FIELDS, values))
+
+
+class ProductFragments:
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._fragments = {}
+        self._lock = threading.Lock()
+
+    def encode(self, row):
+        # product listing rows start with PRODUCT_FIELDS, search adds a rank after them
+        values = tuple(row[:len(PRODUCT_FIELDS)])
+        cached = self._fragments.get(values[0])
+        if cached is not None and cached[0] == values:
+            return cached[1]
+        fragment = dumps(product_to_dict(values))
+        with self._lock:
+            if len(self._fragments) >= self.maxsize:
+                self._fragments.clear()
+            self._fragments[values[0]] = (values, fragment)
+        return fragment
+
+    def forget(self, product_id):
+        with self._lock:
+            self._fragments.pop(int(product_id), None)
+
+
+product_fragments = ProductFragments(FRAGMENT_CACHE_SIZE)
+
+
+def forget_product(product_id):
+    product_fragments.forget(product_id)
+
+
+def json_array(fragments):
+    return b"[" + b",".join(fragments) + b"]"
+
+
+def page_body(array, next_cursor, paginated):
+    """Wraps an encoded array the way pagination.page_response() does."""
+    if not paginated:
+        return array
+    return b'{"items":' + array + b',"next_cursor":' + dumps(next_cursor) + b"}"
+
+
+def encode_products(rows):
+    return json_array([product_fragments.encode(row) for row in rows])
+
+
+def encode_row(row):
+    return dumps(row_to_dict(row))
+
+
+def encode_rows(rows):
+    return json_array([encode_row(row) for row in rows])
+
+
+def json_response(body, status=200):
+    return current_app.response_class(body, status=status, mimetype="application/json")
@@ -0,0 +1,35 @@
+"""
+Streaming JSON arrays for large collections.
+
+List routes switch to this mode with ?stream=1. Rows are read with
+yield_per() (a server side cursor on PostgreSQL) and encoded one batch at
+a time into a chunked response, so neither the ORM rows nor the encoded
+body of the whole collection are held in memory at once.
+"""
+from flask import Response, request, stream_with_context
+
+BATCH_SIZE = 1000
+
+
+def wants_stream():
+    return request.args.get("stream", "").lower() in ("1", "true")
+
+
+def stream_json_array(query, encode, batch_size=BATCH_SIZE):
+    """`encode` turns one row into its JSON bytes (see api.serializers)."""
+
+    def generate():
+        yield b"["
+        separator = b""
+        batch = []
+        for row in query.yield_per(batch_size):
+            batch.append(encode(row))
+            if len(batch) == batch_size:
+                yield separator + b",".join(batch)
+                separator = b","
+                batch = []
+        if batch:
+            yield separator + b",".join(batch)
+        yield b"]"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
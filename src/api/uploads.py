@@ -0,0 +1,211 @@
+"""
+Background pipeline for product image uploads.
+
+The write routes save the product right away with image_status "pending"
+and hand the file bytes to the pipeline; a bounded thread pool uploads
+them, retrying with backoff, and then stores the photo url and sets the
+status to "ready" (or "failed"). The uploader is pluggable:
+UPLOADER=cloudinary (default) or UPLOADER=local, which writes the files
+to UPLOAD_DIR and is meant for development and tests.
+
+The status lives on the product row (image_status, image_queued_at,
+image_attempts, image_error), so every worker reports the same one. The
+queue itself is in the memory of the worker that took the upload: when
+that worker dies or is recycled, its products would stay "pending"
+forever. sweep() marks the ones pending for longer than
+UPLOAD_STALE_MINUTES (default 30) as "failed", from `flask sweep-uploads`,
+from a thread every UPLOAD_SWEEP_INTERVAL seconds (default 300, 0 turns it
+off) and for a single product when its status is asked for.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from api import catalog, listing
+from api.models import db, Product
+from api.utils import APIException
+
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"
+
+STALE_AFTER = timedelta(minutes=int(os.getenv("UPLOAD_STALE_MINUTES", 30)))
+SWEEP_INTERVAL = int(os.getenv("UPLOAD_SWEEP_INTERVAL", 300))
+LOST_ERROR = "the upload was lost, send the photo again"
+
+
+class CloudinaryUploader:
+
+    def __init__(self, folder="mygallery"):
+        self.folder = folder
+        self._configured = False
+
+    def configure(self):
+        # cloudinary is imported and configured on the first upload, not at app start
+        import cloudinary
+        if not self._configured:
+            cloudinary.config(
+                cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+                api_key=os.getenv("CLOUDINARY_API_KEY"),
+                api_secret=os.getenv("CLOUDINARY_API_SECRET"),
+                secure=True,
+            )
+            self._configured = True
+
+    def upload(self, data, filename):
+        self.configure()
+        import cloudinary.uploader
+        resp = cloudinary.uploader.upload(data, folder=self.folder)
+        if not resp:
+            raise RuntimeError("empty response from cloudinary")
+        return resp["secure_url"], resp["public_id"]
+
+
+class LocalUploader:
+
+    def __init__(self, directory, base_url):
+        self.directory = directory
+        self.base_url = base_url.rstrip("/")
+
+    def upload(self, data, filename):
+        os.makedirs(self.directory, exist_ok=True)
+        public_id = f"{uuid.uuid4().hex}{os.path.splitext(filename or '')[1]}"
+        with open(os.path.join(self.directory, public_id), "wb") as f:
+            f.write(data)
+        return f"{self.base_url}/{public_id}", public_id
+
+
+def uploader_from_env():
+    if os.getenv("UPLOADER", "cloudinary") == "local":
+        return LocalUploader(os.getenv("UPLOAD_DIR", "/tmp/uploads"), os.getenv("UPLOAD_BASE_URL", "/uploads"))
+    return CloudinaryUploader()
+
+
+class UploadPipeline:
+
+    def __init__(self, uploader, workers=4, queue_size=32, retries=3, backoff=1.0):
+        self.uploader = uploader
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._sweeper = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            uploader_from_env(),
+            workers=int(os.getenv("UPLOAD_WORKERS", 4)),
+            queue_size=int(os.getenv("UPLOAD_QUEUE_SIZE", 32)),
+            retries=int(os.getenv("UPLOAD_RETRIES", 3)),
+            backoff=float(os.getenv("UPLOAD_RETRY_BACKOFF", 1.0)),
+        )
+
+    def executor(self):
+        # created on first use so every gunicorn worker gets its own threads
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="upload")
+            return self._executor
+
+    def reserve(self):
+        """
+        Takes a queue slot before the product is saved, so a full queue
+        refuses the request with a 503 before anything is written. The slot
+        is used by submit(), or given back with release() if saving fails.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise APIException("Demasiadas imágenes en cola, intente más tarde", status_code=503)
+
+    def release(self):
+        self._slots.release()
+
+    def mark_pending(self, product):
+        """Sets a product that is about to be saved with a new photo to "pending"."""
+        product.image_status = PENDING
+        product.image_queued_at = datetime.now()
+        product.image_attempts = 0
+        product.image_error = None
+
+    def submit(self, app, product, data, filename):
+        """Queues an upload, in the slot taken by reserve(), for a product saved after mark_pending()."""
+        try:
+            self.executor().submit(self._run, app, product.id, product.image_queued_at, data, filename)
+        except Exception:
+            self._slots.release()
+            raise
+        self.start_sweeper(app)
+
+    def _run(self, app, product_id, queued_at, data, filename):
+        try:
+            result, attempts, error = None, 0, None
+            while result is None:
+                attempts += 1
+                try:
+                    result = self.uploader.upload(data, filename)
+                except Exception as e:
+                    error = str(e)
+                    if attempts > self.retries:
+                        break
+                    time.sleep(self.backoff * 2 ** (attempts - 1))
+            with app.app_context():
+                self._finish(product_id, queued_at, result, attempts, error if result is None else None)
+        finally:
+            self._slots.release()
+
+    def _finish(self, product_id, queued_at, result, attempts, error):
+        product = db.session.get(Product, product_id)
+        if product is None or product.image_queued_at != queued_at:
+            # deleted, or a newer upload for the same product was queued meanwhile
+            return
+        if result is None:
+            product.image_status = FAILED
+        else:
+            product.photo, product.public_id = result
+            product.image_status = READY
+        product.image_attempts, product.image_error = attempts, error
+        category_id = product.category_id
+        listing.sync_products(product_id)
+        db.session.commit()
+        catalog.products_changed(product_id, category_id)
+
+    def sweep(self, product_id=None, stale_after=STALE_AFTER):
+        """Marks the uploads pending for longer than `stale_after` as failed; returns how many."""
+        # rows left pending before image_queued_at existed count as stale
+        stale = or_(Product.image_queued_at < datetime.now() - stale_after, Product.image_queued_at.is_(None))
+        query = Product.query.filter(Product.image_status == PENDING, stale)
+        if product_id is not None:
+            query = query.filter(Product.id == product_id)
+        swept = query.update({Product.image_status: FAILED, Product.image_error: LOST_ERROR},
+                             synchronize_session=False)
+        db.session.commit()
+        return swept
+
+    def start_sweeper(self, app, interval=SWEEP_INTERVAL):
+        """Starts the background sweeper thread of this process once, when `interval` is set."""
+        if interval <= 0 or self._sweeper is not None:
+            return
+        with self._lock:
+            if self._sweeper is not None:
+                return
+
+            def run():
+                while True:
+                    time.sleep(interval)
+                    with app.app_context():
+                        try:
+                            self.sweep()
+                        except Exception:
+                            db.session.rollback()
+                            app.logger.exception("upload sweep failed")
+
+            self._sweeper = threading.Thread(target=run, name="upload-sweeper", daemon=True)
+            self._sweeper.start()
+
+
+upload_pipeline = UploadPipeline.from_env()
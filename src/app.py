@@ -3,98 +3,107 @@ This module takes care of starting the API Server, Loading the DB and Adding the
 """
 import os
 import sys
-import cloudinary
+import click
 from flask import Flask, request, jsonify, url_for, send_from_directory
-from flask_migrate import Migrate
-from flask_swagger import swagger
 from api.utils import APIException, generate_sitemap
 from flask_jwt_extended import JWTManager
 from api.models import db
-from api.routes import api
+from api.pool import engine_options
+from api.replica import setup_replica
+from api.routes import api, test_db
 from api.admin import setup_admin
-from api.commands import setup_commands
+from api.metrics import setup_metrics
+from api.profiling import setup_profiling
 from flask_cors import CORS
-from src.api.routes import test_db  # Ajusta según el nombre real del módulo
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = Flask(__name__)
-app.register_blueprint(test_db)  # Agregar la ruta a la API
-
-
-
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-# from models import Person
-app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
-
-cloudinary.config(
-    cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key= os.getenv("CLOUDINARY_API_KEY"),
-    api_secret = os.getenv("CLOUDINARY_API_SECRET"),
-    secure=True
-    
-)
 
 ENV = "development" if os.getenv("FLASK_DEBUG") == "1" else "production"
 static_file_dir = os.path.join(os.path.dirname(
     os.path.realpath(__file__)), '../public/')
-app = Flask(__name__)
-app.url_map.strict_slashes = False
-
-# database condiguration
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace(
-        "postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
-
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['JWT_SECRET_KEY'] = "my-secret-key"
-MIGRATE = Migrate(app, db, compare_type=True)
-db.init_app(app)
-jwt = JWTManager(app)
-
-# add the admin
-setup_admin(app)
-
-# add the admin
-setup_commands(app)
-
-# Add all endpoints form the API with a "api" prefix
-app.register_blueprint(api, url_prefix='/api')
-
-# Handle/serialize errors like a JSON object
-
-
-@app.errorhandler(APIException)
-def handle_invalid_usage(error):
-    return jsonify(error.to_dict()), error.status_code
-
-# generate sitemap with all your endpoints
-
-
-@app.route('/')
-def sitemap():
-    if ENV == "development":
-        return generate_sitemap(app)
-    return send_from_directory(static_file_dir, 'index.html')
-
-# any other endpoint will try to serve it like a static file
-@app.route('/<path:path>', methods=['GET'])
-def serve_any_other_file(path):
-    if not os.path.isfile(os.path.join(static_file_dir, path)):
-        path = 'index.html'
-    response = send_from_directory(static_file_dir, path)
-    response.cache_control.max_age = 0  # avoid cache memory
-    return response
-
-
-# this only runs if `$ python src/main.py` is executed
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../migrations')
+
+
+def running_flask_cli():
+    # `flask --help` loads the app before click has pushed a context, hence the argv check
+    return click.get_current_context(silent=True) is not None or os.path.basename(sys.argv[0]) == "flask"
+
+
+def create_app():
+    """
+    Builds the app. `flask` finds this factory through FLASK_APP=src/app.py,
+    gunicorn serves the app built in wsgi.py (see gunicorn_config.py).
+    """
+    app = Flask(__name__)
+    app.url_map.strict_slashes = False
+    CORS(app, resources={r"/*": {"origins": "*"}})
+
+    # database condiguration
+    db_url = os.getenv("DATABASE_URL")
+    if db_url is not None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace(
+            "postgres://", "postgresql://")
+    else:
+        app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    # optional read replica (DATABASE_REPLICA_URL)
+    setup_replica(app, engine_options)
+
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['JWT_SECRET_KEY'] = "my-secret-key"
+    db.init_app(app)
+    JWTManager(app)
+
+    # add the admin, built on its first request
+    setup_admin(app)
+
+    # migrations and commands (and their imports) are only needed when `flask` runs a command
+    if running_flask_cli():
+        from flask_migrate import Migrate
+        from api.commands import setup_commands
+        # migrations/ next to src/, whichever directory `flask` runs from; batch mode lets
+        # SQLite alter tables
+        Migrate(app, db, directory=MIGRATIONS_DIR, compare_type=True, render_as_batch=True)
+        setup_commands(app)
+
+    # request and database metrics on /metrics
+    setup_metrics(app)
+
+    # admin-only profiling of single requests (X-Profile: 1)
+    setup_profiling(app)
+
+    # Add all endpoints form the API with a "api" prefix
+    app.register_blueprint(api, url_prefix='/api')
+    app.register_blueprint(test_db)
+
+    # Handle/serialize errors like a JSON object
+    @app.errorhandler(APIException)
+    def handle_invalid_usage(error):
+        return jsonify(error.to_dict()), error.status_code
+
+    # generate sitemap with all your endpoints
+    @app.route('/')
+    def sitemap():
+        if ENV == "development":
+            return generate_sitemap(app)
+        return send_from_directory(static_file_dir, 'index.html')
+
+    # any other endpoint will try to serve it like a static file
+    @app.route('/<path:path>', methods=['GET'])
+    def serve_any_other_file(path):
+        if not os.path.isfile(os.path.join(static_file_dir, path)):
+            path = 'index.html'
+        response = send_from_directory(static_file_dir, path)
+        response.cache_control.max_age = 0  # avoid cache memory
+        return response
+
+    return app
+
+
+# this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3001))
-    app.run(host='0.0.0.0', port=PORT, debug=True)
-
-print("DATABASE_URL:", os.getenv("DATABASE_URL"))
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=PORT, debug=True)
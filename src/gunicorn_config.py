@@ -0,0 +1,88 @@
+"""
+gunicorn settings, read from the environment:
+
+    $ gunicorn -c src/gunicorn_config.py wsgi --chdir ./src/
+
+    WEB_WORKER_CLASS   sync, gthread (default) or gevent
+    WEB_CONCURRENCY    worker processes (default from the usable CPUs, at most
+                       MAX_DEFAULT_WORKERS; set it explicitly in containers)
+    WEB_THREADS        threads per gthread worker (default 4)
+    WEB_WORKER_CONNECTIONS  concurrent requests per gevent worker (default 100)
+    WEB_TIMEOUT        seconds before a stuck worker is restarted (default 60)
+    WEB_PRELOAD        import the app once in the master, 1 or 0
+                       (default 1, except for gevent)
+
+gthread suits this app best: image uploads and password hashing already
+run off the request threads, so a few threads per worker keep catalog
+reads flowing while other requests wait on the database or Cloudinary.
+gevent needs `pip install gevent psycogreen` and is not preloaded, so the
+monkey patching happens before the app imports its libraries.
+
+With preload the app is built once in the master and forked, which saves
+memory and start-up time; the workers then drop the inherited database
+pool (without closing the master's connections) and open their own.
+"""
+import os
+import shutil
+
+worker_class = os.getenv("WEB_WORKER_CLASS", "gthread")
+if worker_class not in ("sync", "gthread", "gevent"):
+    raise RuntimeError(f"WEB_WORKER_CLASS must be sync, gthread or gevent, not {worker_class!r}")
+
+# every worker holds its own database pool and password hashing processes
+MAX_DEFAULT_WORKERS = 8
+
+try:
+    # the CPUs this process may run on; cpu_count() is the whole host's in a container.
+    # A CPU quota (cgroups) is not visible here either, hence WEB_CONCURRENCY in render.yaml
+    cpus = len(os.sched_getaffinity(0))
+except AttributeError:
+    # macOS
+    cpus = os.cpu_count() or 1
+# sync workers serve one request each, so they need more processes
+default_workers = min(MAX_DEFAULT_WORKERS, 2 * cpus + 1 if worker_class == "sync" else cpus + 1)
+workers = int(os.getenv("WEB_CONCURRENCY", default_workers))
+threads = int(os.getenv("WEB_THREADS", 4)) if worker_class == "gthread" else 1
+worker_connections = int(os.getenv("WEB_WORKER_CONNECTIONS", 100))
+
+bind = f"0.0.0.0:{os.getenv('PORT', 3001)}"
+timeout = int(os.getenv("WEB_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+# recycle workers now and then so slow leaks never pile up
+max_requests = 1000
+max_requests_jitter = 100
+
+preload_app = os.getenv("WEB_PRELOAD", "0" if worker_class == "gevent" else "1") == "1"
+
+# metrics of all workers are collected in this directory (see api/metrics.py); it is
+# read when prometheus_client is imported, so it is set up here, before the app loads
+if workers > 1:
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus")
+if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    # values left by a previous run would be added to this one
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+
+
+def post_fork(server, worker):
+    if worker_class == "gevent":
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning("psycogreen is not installed, PostgreSQL calls will block the gevent worker")
+    if preload_app:
+        # the pool was created in the master: forget its connections without closing them,
+        # they still belong to the master's process
+        from wsgi import application
+        from api.models import db
+        with application.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,159 @@
+import os
+import time
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event
+
+# read when the app is built, so they are set before anything imports it
+os.environ.pop("DATABASE_REPLICA_URL", None)
+os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp_path_factory.mktemp('db') / 'test.db'}"
+    from flask_migrate import Migrate, upgrade
+    from app import MIGRATIONS_DIR, create_app
+    from api.models import db
+
+    app = create_app()
+    app.config["TESTING"] = True
+    # the schema comes from the migrations, as in production
+    Migrate(app, db, directory=MIGRATIONS_DIR, render_as_batch=True)
+    with app.app_context():
+        upgrade()
+        yield app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def uncached_catalog(monkeypatch):
+    """Every request reads the catalog version and misses the response cache."""
+    from api import catalog
+    from api.cache import catalog_cache
+
+    monkeypatch.setattr(catalog.version_clock, "ttl", 0)
+    catalog_cache.clear()
+    yield catalog_cache
+    catalog_cache.clear()
+
+
+class QueryCounter:
+    """Counts the SQL statements sent to the app's engine inside a `with` block."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+@pytest.fixture
+def query_counter(app):
+    """Returns a new QueryCounter on the app's engine; use it as `with query_counter() as queries:`."""
+    from api.models import db
+
+    return lambda: QueryCounter(db.engine)
+
+
+@pytest.fixture
+def scratch_products(app):
+    """`with scratch_products(count) as (category, subcategory):` products in a throwaway category."""
+    from api import listing
+    from api.models import db, Category, Subcategory, Product
+
+    @contextmanager
+    def products(count):
+        category = Category(name="test-products")
+        db.session.add(category)
+        db.session.flush()
+        subcategory = Subcategory(name="test-products", category_id=category.id)
+        db.session.add(subcategory)
+        db.session.commit()
+        try:
+            db.session.execute(Product.__table__.insert(), [
+                {"name": f"bench product {i}", "public_id": "bench", "photo": "bench", "amount": 0,
+                 "price": 10, "category_id": category.id, "subcategory_id": subcategory.id}
+                for i in range(count)
+            ])
+            listing.sync_category(category.id)
+            db.session.commit()
+            yield category, subcategory
+        finally:
+            db.session.rollback()
+            Product.query.filter_by(category_id=category.id).delete(synchronize_session=False)
+            listing.sync_category(category.id)
+            db.session.delete(subcategory)
+            db.session.delete(category)
+            db.session.commit()
+
+    return products
+
+
+@pytest.fixture
+def scratch_customer(app):
+    """
+    `with scratch_customer(product_count, stock) as (user, products):` a
+    throwaway user and products with `stock` units each; their orders and
+    stock ledger are removed afterwards.
+    """
+    from api import inventory, listing
+    from api.models import db, Category, Subcategory, Product, User, Order, OrderDetail, Stock
+
+    @contextmanager
+    def customer(product_count, stock=1000):
+        category = Category(name="test-orders")
+        db.session.add(category)
+        db.session.flush()
+        subcategory = Subcategory(name="test-orders", category_id=category.id)
+        db.session.add(subcategory)
+        db.session.flush()
+        products = [
+            Product(name=f"bench product {i}", public_id="bench", photo="bench", amount=stock, price=10,
+                    category_id=category.id, subcategory_id=subcategory.id)
+            for i in range(product_count)
+        ]
+        user = User(name="test", lastname="test", email=f"test-orders-{time.time_ns()}@example.com",
+                    password="-", salt="-")
+        db.session.add_all(products + [user])
+        db.session.flush()
+        for product in products:
+            inventory.open_stock(product.id, stock)
+        product_ids = [product.id for product in products]
+        listing.sync_products(*product_ids)
+        db.session.commit()
+        try:
+            yield user, products
+        finally:
+            db.session.rollback()
+            order_ids = db.session.query(Order.id).filter(Order.user_id == user.id)
+            Stock.query.filter(Stock.products_id.in_(product_ids)).delete(synchronize_session=False)
+            OrderDetail.query.filter(OrderDetail.order_id.in_(order_ids)).delete(synchronize_session=False)
+            Order.query.filter(Order.user_id == user.id).delete(synchronize_session=False)
+            for row in products + [user, subcategory, category]:
+                db.session.delete(row)
+            listing.sync_products(*product_ids)
+            db.session.commit()
+
+    return customer
+
+
+@pytest.fixture
+def auth_headers(app):
+    """Returns the Authorization header of a user."""
+    from flask_jwt_extended import create_access_token
+
+    return lambda user: {"Authorization": f"Bearer {create_access_token(identity=str(user.id))}"}
@@ -0,0 +1,21 @@
+from api.admin import build_admin
+from api.models import db, User
+
+
+def test_admin_uses_the_app_engine(app):
+    admin_app = build_admin(app)
+
+    assert "sqlalchemy" not in admin_app.extensions
+    [view] = [view for view in admin_app.extensions["admin"][0]._views if getattr(view, "model", None) is User]
+    assert view.session.get_bind() is db.engine
+
+
+def test_admin_lists_users(app, client):
+    user = User(name="Admin", lastname="Page", email="admin-page@example.com", password="x", salt="x")
+    db.session.add(user)
+    db.session.commit()
+
+    response = client.get("/admin/user/")
+
+    assert response.status_code == 200
+    assert b"admin-page@example.com" in response.data
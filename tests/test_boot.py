@@ -0,0 +1,14 @@
+import os
+from api.benchmarks import best_import_profile
+
+ROOT = os.path.join(os.path.dirname(__file__), "..", "src")
+BUDGET_MS = int(os.getenv("IMPORT_TIME_BUDGET_MS", 800))
+
+
+def test_worker_boot_imports(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'boot.db'}")
+
+    total, modules, eager = best_import_profile(ROOT)
+
+    assert not eager, f"imported at boot but meant to load lazily: {', '.join(eager)}"
+    assert total <= BUDGET_MS, f"import wsgi took {total:.0f} ms: {modules[:5]}"
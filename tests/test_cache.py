@@ -0,0 +1,48 @@
+from api import cache
+from api.cache import LRUCache
+
+
+def test_unknown_query_parameters_share_one_entry(client, uncached_catalog, monkeypatch, scratch_products):
+    monkeypatch.setattr(cache, "stock_window", lambda: 0)
+    hits = uncached_catalog.hits
+    with scratch_products(3):
+        for number in range(20):
+            assert client.get(f"/api/products?x={number}").status_code == 200
+        assert client.get("/api/products?limit=2").status_code == 200
+
+    assert uncached_catalog.stats()["size"] == 2
+    assert uncached_catalog.hits - hits == 19
+
+
+def test_cache_is_bounded_by_bytes():
+    cache = LRUCache(maxsize=100, maxbytes=10)
+    cache.set("a", b"1234")
+    cache.set("b", b"1234")
+    cache.set("c", b"1234")
+    cache.set("huge", b"x" * 11)
+
+    assert cache.get("a") is None
+    assert cache.get("b") == cache.get("c") == b"1234"
+    assert cache.get("huge") is None
+    assert cache.bytes == 8
+
+
+def test_not_modified_runs_no_sql(client, query_counter, scratch_products):
+    with scratch_products(3) as (category, _):
+        path = f"/api/products/categories/{category.id}"
+        etag = client.get(path).headers["ETag"]
+        with query_counter() as queries:
+            response = client.get(path, headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert queries.count == 0
+
+
+def test_catalog_write_changes_the_etag(client, scratch_products):
+    with scratch_products(3):
+        etag = client.get("/api/products").headers["ETag"]
+        assert client.post("/api/categories", json={"name": "etag test"}).status_code == 200
+        response = client.get("/api/products", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
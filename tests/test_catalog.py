@@ -0,0 +1,40 @@
+def listing(client, cache, query_counter, path):
+    cache.clear()
+    with query_counter() as queries:
+        response = client.get(path)
+    assert response.status_code == 200
+    return queries.count, response.get_json()
+
+
+def test_category_listing_query_count_does_not_grow_with_products(client, uncached_catalog, query_counter,
+                                                                 scratch_products):
+    with scratch_products(20) as (small, _), scratch_products(200) as (large, _):
+        small_queries, small_body = listing(client, uncached_catalog, query_counter,
+                                             f"/api/products/categories/{small.id}")
+        large_queries, large_body = listing(client, uncached_catalog, query_counter,
+                                             f"/api/products/categories/{large.id}")
+
+    assert (len(small_body), len(large_body)) == (20, 200)
+    assert small_queries == large_queries
+
+
+def test_listing_rows_match_product_serialize(client, uncached_catalog, query_counter, scratch_products):
+    from api.models import Product
+
+    with scratch_products(5) as (category, _):
+        _, body = listing(client, uncached_catalog, query_counter, f"/api/products/categories/{category.id}")
+        expected = [product.serialize() for product in Product.query.filter_by(category_id=category.id)
+                    .order_by(Product.id)]
+    assert body == expected
+
+
+def test_related_pool_reloads_when_the_catalog_version_changes(scratch_products):
+    from api.related import RelatedProducts
+
+    related = RelatedProducts()
+    with scratch_products(3) as (category, _):
+        # a pool another worker read before the products were written
+        related._pools[category.id] = (1, ())
+
+        assert related.pool(category.id, 1) == ()
+        assert len(related.pool(category.id, 2)) == 3
@@ -0,0 +1,114 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from sqlalchemy import func
+from api import cache, inventory
+from api.models import db, Order, OrderDetail, Product, ProductListing, Stock
+
+
+@pytest.fixture
+def order(auth_headers):
+    def place(client, user, product, quantity=1, **item):
+        item = {"product_id": product.id, "quantity": quantity, "price": 10, "name": "test", **item}
+        return client.post("/api/order", json={"total": 10 * quantity, "items": [item]}, headers=auth_headers(user))
+
+    return place
+
+
+def test_concurrent_orders_never_oversell(app, scratch_customer, auth_headers):
+    stock = 20
+    with scratch_customer(3, stock=stock) as (user, products):
+        headers = auth_headers(user)
+        product_ids = [product.id for product in products]
+
+        def place(number):
+            # two products per order, far more units than there are in total
+            rng = random.Random(number)
+            items = [{"product_id": product_id, "quantity": rng.randint(1, 3), "price": 10, "name": "test"}
+                     for product_id in rng.sample(product_ids, 2)]
+            return app.test_client().post("/api/order", json={"total": 20, "items": items}, headers=headers).status_code
+
+        with ThreadPoolExecutor(8) as pool:
+            statuses = set(pool.map(place, range(60)))
+
+        db.session.rollback()
+        order_ids = db.session.query(Order.id).filter(Order.user_id == user.id)
+        sold = dict(db.session.query(OrderDetail.product_id, func.sum(OrderDetail.quantity))
+                    .filter(OrderDetail.order_id.in_(order_ids)).group_by(OrderDetail.product_id))
+        amounts = dict(db.session.query(Product.id, Product.amount).filter(Product.id.in_(product_ids)))
+        listed = dict(db.session.query(ProductListing.id, ProductListing.amount)
+                      .filter(ProductListing.id.in_(product_ids)))
+
+        assert statuses == {200, 409}
+        for product_id in product_ids:
+            units = sold.get(product_id, 0)
+            assert units <= stock
+            assert amounts[product_id] == listed[product_id] == stock - units == inventory.balance(product_id)
+
+
+def test_short_order_is_refused_with_what_is_missing(client, scratch_customer, order):
+    with scratch_customer(1, stock=2) as (user, [product]):
+        response = order(client, user, product, quantity=3)
+
+        assert response.status_code == 409
+        assert response.get_json()["items"] == [{"product_id": product.id, "requested": 3, "available": 2}]
+        assert Order.query.filter_by(user_id=user.id).count() == 0
+
+
+@pytest.mark.parametrize("item", [{"price": None}, {"price": "ten"}, {"name": None}, {"name": ""}, {"name": 5}])
+def test_order_items_need_a_price_and_a_name(client, scratch_customer, order, item):
+    with scratch_customer(1) as (user, [product]):
+        response = order(client, user, product, **item)
+
+        assert response.status_code == 400
+        assert Order.query.filter_by(user_id=user.id).count() == 0
+
+
+def test_order_without_price_is_a_bad_request(client, scratch_customer, auth_headers):
+    with scratch_customer(1) as (user, [product]):
+        body = {"total": 10, "items": [{"product_id": product.id, "quantity": 1, "name": "test"}]}
+        response = client.post("/api/order", json=body, headers=auth_headers(user))
+
+        assert response.status_code == 400
+
+
+def test_order_shows_in_cached_listings_with_the_next_stock_window(client, monkeypatch, scratch_customer, order):
+    monkeypatch.setattr(cache, "stock_window", lambda: 0)
+    with scratch_customer(1, stock=5) as (user, [product]):
+        path = f"/api/products/{product.id}"
+        before = client.get(path)
+        assert before.get_json()["amount"] == 5
+
+        assert order(client, user, product, quantity=2).status_code == 200
+        assert client.get(path, headers={"If-None-Match": before.headers["ETag"]}).status_code == 304
+
+        monkeypatch.setattr(cache, "stock_window", lambda: 1)
+        after = client.get(path, headers={"If-None-Match": before.headers["ETag"]})
+        assert after.status_code == 200
+        assert after.headers["ETag"] != before.headers["ETag"]
+        assert after.get_json()["amount"] == 3
+
+
+@pytest.mark.parametrize("amount", ["3.5", "-1", "abc", "nan"])
+def test_product_amount_must_be_whole_units(client, scratch_products, amount):
+    with scratch_products(1) as (category, _):
+        product = Product.query.filter_by(category_id=category.id).one()
+        response = client.put(f"/api/products/{product.id}", data={"amount": amount})
+
+        assert response.status_code == 400
+        assert inventory.balance(product.id) == 0
+
+
+def test_deleted_product_keeps_a_closed_ledger(client, scratch_products):
+    with scratch_products(1) as (category, _):
+        product_id = Product.query.filter_by(category_id=category.id).one().id
+        assert client.put(f"/api/products/{product_id}", data={"amount": "4"}).status_code == 200
+        assert client.put(f"/api/products/{product_id}", data={"amount": "10.0"}).status_code == 200
+        assert db.session.query(Product.amount).filter_by(id=product_id).scalar() == inventory.balance(product_id) == 10
+
+        assert client.delete(f"/api/products/{product_id}").status_code == 200
+
+        ledger = Stock.query.filter_by(products_id=product_id).order_by(Stock.id).all()
+        assert [(row.reason, row.quantity) for row in ledger] == [("adjustment", 4), ("adjustment", 6), ("closing", -10)]
+        Stock.query.filter_by(products_id=product_id).delete()
+        db.session.commit()
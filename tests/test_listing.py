@@ -0,0 +1,28 @@
+from sqlalchemy import update
+from api import listing
+from api.models import db, Product, ProductListing
+
+
+def test_sync_updates_the_row_already_there(scratch_products):
+    with scratch_products(2) as (category, _):
+        first, second = Product.query.filter_by(category_id=category.id).order_by(Product.id)
+        # what a concurrent sync of the same product leaves behind
+        db.session.execute(update(Product.__table__).where(Product.id == first.id).values(name="renamed"))
+
+        listing.sync_products(first.id)
+        listing.sync_products(first.id)
+        db.session.commit()
+
+        rows = dict(db.session.query(ProductListing.id, ProductListing.name).filter_by(category_id=category.id))
+        assert rows == {first.id: "renamed", second.id: "bench product 1"}
+
+
+def test_sync_removes_deleted_products(scratch_products):
+    with scratch_products(2) as (category, _):
+        first, second = Product.query.filter_by(category_id=category.id).order_by(Product.id)
+        db.session.delete(first)
+
+        listing.sync_products(first.id, second.id)
+        db.session.commit()
+
+        assert [row.id for row in ProductListing.query.filter_by(category_id=category.id)] == [second.id]
@@ -0,0 +1,15 @@
+import os
+import subprocess
+import sys
+
+
+def test_app_imports_with_a_missing_multiprocess_directory(tmp_path):
+    directory = tmp_path / "prometheus" / "missing"
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(directory),
+           "DATABASE_URL": f"sqlite:///{tmp_path / 'metrics.db'}"}
+    root = os.path.join(os.path.dirname(__file__), "..", "src")
+
+    result = subprocess.run([sys.executable, "-c", "import wsgi"], cwd=root, env=env, capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
+    assert directory.is_dir()
@@ -0,0 +1,33 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from api.models import db, Order, OrderDetail
+
+
+def test_parallel_retries_create_a_single_order(app, scratch_customer, auth_headers):
+    threads = 8
+    with scratch_customer(5) as (user, products):
+        headers = {**auth_headers(user), "Idempotency-Key": "parallel-retries"}
+        body = {
+            "total": 10 * len(products),
+            "items": [{"product_id": product.id, "quantity": 1, "price": product.price, "name": product.name}
+                      for product in products],
+        }
+        barrier = threading.Barrier(threads)
+
+        def post(_):
+            client = app.test_client()
+            barrier.wait()
+            response = client.post("/api/order", json=body, headers=headers)
+            return response.status_code, (response.get_json() or {}).get("order_id")
+
+        with ThreadPoolExecutor(threads) as pool:
+            responses = list(pool.map(post, range(threads)))
+
+        db.session.rollback()
+        orders = [order_id for (order_id,) in db.session.query(Order.id).filter(Order.user_id == user.id)]
+        details = OrderDetail.query.filter(OrderDetail.order_id.in_(orders)).count()
+
+    assert len(orders) == 1
+    assert details == 5
+    assert {status for status, _ in responses} == {200}
+    assert {order_id for _, order_id in responses} == set(orders)
@@ -0,0 +1,38 @@
+import pytest
+from api.pagination import encode_cursor
+
+
+@pytest.mark.parametrize("values", [["a"], [True], [None], [1, 2], [[1]]])
+def test_cursor_with_wrong_values_is_rejected(client, uncached_catalog, values):
+    response = client.get(f"/api/products?limit=5&after={encode_cursor(values)}")
+    assert response.status_code == 400
+
+
+def test_search_cursor_accepts_float_rank(client, uncached_catalog):
+    response = client.get(f"/api/products/search?q=bench&limit=5&after={encode_cursor([-1.5, 3])}")
+    assert response.status_code == 200
+
+
+def test_pages_follow_each_other(client, uncached_catalog, scratch_products):
+    with scratch_products(7) as (category, _):
+        path = f"/api/products/categories/{category.id}?limit=3"
+        seen, cursor = [], None
+        while True:
+            page = client.get(path + (f"&after={cursor}" if cursor else "")).get_json()
+            seen += [product["id"] for product in page["items"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+    assert len(seen) == 7 and seen == sorted(seen)
+
+
+def test_streamed_category_listing_matches_the_paginated_one(client, uncached_catalog, scratch_products):
+    with scratch_products(3) as (category, _):
+        streamed = client.get(f"/api/products/categories/{category.id}?stream=1").get_json()
+        paginated = client.get(f"/api/products/categories/{category.id}").get_json()
+    assert streamed == paginated
+
+
+@pytest.mark.parametrize("query", ["", "?stream=1"])
+def test_unknown_category_is_not_found(client, uncached_catalog, query):
+    assert client.get(f"/api/products/categories/999999{query}").status_code == 404
@@ -0,0 +1,44 @@
+from datetime import datetime
+import pytest
+from flask_migrate import Migrate, upgrade
+from api.models import db, Order
+from api.replica import sync_sqlite
+
+
+@pytest.fixture
+def replica_app(app, tmp_path, monkeypatch):
+    """An app on two SQLite files, a primary and its replica; yields (app, sync the replica)."""
+    from app import MIGRATIONS_DIR, create_app
+
+    primary, replica = str(tmp_path / "primary.db"), str(tmp_path / "replica.db")
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{primary}")
+    monkeypatch.setenv("DATABASE_REPLICA_URL", f"sqlite:///{replica}")
+    replica_app = create_app()
+    replica_app.config["TESTING"] = True
+    Migrate(replica_app, db, directory=MIGRATIONS_DIR, render_as_batch=True)
+    with replica_app.app_context():
+        upgrade()
+        yield replica_app, lambda: sync_sqlite(primary, replica)
+        db.session.remove()
+
+
+def test_writes_are_followed_by_primary_reads(replica_app, scratch_customer, auth_headers):
+    app, sync = replica_app
+    with scratch_customer(1) as (writer, [product]), scratch_customer(1) as (reader, _):
+        sync()
+        # only on the primary, and not written through the API
+        db.session.add(Order(user_id=reader.id, price=10, address="-", deliver_address="-", status="OK"))
+        db.session.commit()
+        # no cookies: the JWT identity alone has to send the writer to the primary
+        client = app.test_client(use_cookies=False)
+
+        body = {"total": 10, "items": [{"product_id": product.id, "quantity": 1, "price": 10, "name": "test"}]}
+        assert client.post("/api/order", json=body, headers=auth_headers(writer)).status_code == 200
+
+        writer_orders = client.get("/api/orders", headers=auth_headers(writer))
+        reader_orders = client.get("/api/orders", headers=auth_headers(reader))
+
+    assert writer_orders.status_code == 200
+    assert len(writer_orders.get_json()) == 1
+    # the reader has written nothing, so its reads go to the replica, which lags behind
+    assert reader_orders.status_code == 404
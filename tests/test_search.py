@@ -0,0 +1,57 @@
+import importlib.util
+import os
+import pytest
+from sqlalchemy import text
+from api import search
+from api.models import db
+
+
+def has_search_index():
+    return db.session.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'")).first() is not None
+
+
+def search_migration():
+    from app import MIGRATIONS_DIR
+
+    spec = importlib.util.spec_from_file_location(
+        "search_migration", os.path.join(MIGRATIONS_DIR, "versions", "0004_search_indexes.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def without_search_index(app):
+    """Runs the SQLite statements of the 0004_search_indexes downgrade, and its upgrade afterwards."""
+    migration = search_migration()
+    for statement in migration.SQLITE_DOWNGRADE:
+        db.session.execute(text(statement))
+    db.session.commit()
+    search._fts_ready.clear()
+    yield
+    for statement in migration.SQLITE_UPGRADE:
+        db.session.execute(text(statement))
+    db.session.commit()
+    search._fts_ready.clear()
+
+
+def test_migrations_build_the_search_index(client, uncached_catalog, scratch_products):
+    with scratch_products(3):
+        response = client.get("/api/products/search?q=bench")
+
+        assert response.status_code == 200
+        assert b"bench product 1" in response.data
+        assert search.backend() == "fts5"
+        assert search.rebuild_sqlite_index()
+
+
+def test_search_without_the_index_does_not_create_it(client, uncached_catalog, without_search_index,
+                                                     scratch_products):
+    with scratch_products(3):
+        response = client.get("/api/products/search?q=bench")
+
+        assert response.status_code == 200
+        assert b"bench product 1" in response.data
+        assert not has_search_index()
+        assert search.backend() == "like"
+        assert not search.rebuild_sqlite_index()
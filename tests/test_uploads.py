@@ -0,0 +1,66 @@
+import io
+import threading
+from datetime import datetime, timedelta
+import pytest
+from api import uploads
+from api.models import db, Product
+
+
+@pytest.fixture
+def full_upload_queue(monkeypatch):
+    slots = threading.BoundedSemaphore(1)
+    slots.acquire()
+    monkeypatch.setattr(uploads.upload_pipeline, "_slots", slots)
+    yield slots
+    slots.release()
+
+
+def photo():
+    return (io.BytesIO(b"fake image"), "photo.png")
+
+
+def test_full_queue_refuses_a_new_product_before_saving_it(client, full_upload_queue, scratch_products):
+    with scratch_products(1) as (category, subcategory):
+        before = Product.query.count()
+        response = client.post("/api/products", data={
+            "name": "queued product", "amount": "1", "price": "10", "category_id": str(category.id),
+            "subcategory_id": str(subcategory.id), "photo": photo(),
+        })
+
+        assert response.status_code == 503
+        assert Product.query.count() == before
+
+
+def test_full_queue_leaves_an_edited_product_as_it_was(client, full_upload_queue, scratch_products):
+    with scratch_products(1) as (category, _):
+        product = Product.query.filter_by(category_id=category.id).one()
+        response = client.put(f"/api/products/{product.id}", data={"name": "renamed", "photo": photo()})
+
+        assert response.status_code == 503
+        assert client.get(f"/api/products/{product.id}/image").get_json()["image_status"] == uploads.READY
+        assert db.session.get(Product, product.id).name == "bench product 0"
+
+
+def pending_product(category, queued_at):
+    product = Product.query.filter_by(category_id=category.id).one()
+    product.image_status, product.image_queued_at = uploads.PENDING, queued_at
+    db.session.commit()
+    return product.id
+
+
+def test_upload_left_pending_by_a_dead_worker_fails(client, scratch_products):
+    with scratch_products(1) as (category, _):
+        product_id = pending_product(category, datetime.now() - uploads.STALE_AFTER - timedelta(minutes=1))
+
+        status = client.get(f"/api/products/{product_id}/image").get_json()
+
+        assert status["image_status"] == uploads.FAILED
+        assert status["error"] == uploads.LOST_ERROR
+
+
+def test_recent_upload_stays_pending(client, scratch_products):
+    with scratch_products(1) as (category, _):
+        product_id = pending_product(category, datetime.now())
+
+        assert client.get(f"/api/products/{product_id}/image").get_json()["image_status"] == uploads.PENDING
+        assert uploads.upload_pipeline.sweep() == 0